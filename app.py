@@ -1,8 +1,6 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect, generate_csrf
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 import os
 import logging
@@ -15,6 +13,10 @@ load_dotenv()
 # Create Flask app
 app = Flask(__name__)
 
+# Encode JSON responses with orjson
+from verikey.json_provider import ORJSONProvider
+app.json = ORJSONProvider(app)
+
 # CORS configuration with CSRF support
 CORS(app, origins=[
     "http://localhost:3000",
@@ -26,11 +28,23 @@ CORS(app, origins=[
 # Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Per-process pool; keep (pool_size + max_overflow) x worker processes under Postgres max_connections
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'pool_use_lifo': True,  # Reuse the most recent connections so idle ones can age out
+}
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['REFRESH_SECRET_KEY'] = os.getenv('REFRESH_SECRET_KEY', os.getenv('SECRET_KEY') + '_refresh')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRES', 604800))
 
+# Outbound SES email to the target of each new verification request (off by default)
+app.config['VERIFICATION_EMAILS_ENABLED'] = os.getenv('VERIFICATION_EMAILS_ENABLED', 'False').lower() == 'true'
+
 # CSRF Protection Configuration
 app.config['WTF_CSRF_ENABLED'] = os.getenv('WTF_CSRF_ENABLED', 'True').lower() == 'true'
 app.config['WTF_CSRF_TIME_LIMIT'] = None  # No time limit for CSRF tokens
@@ -53,17 +67,10 @@ def get_limiter_storage_uri():
             print("⚠️ Redis not available, using memory for rate limiting")
     return "memory://"
 
-# Initialize limiter globally
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri=get_limiter_storage_uri(),
-    swallow_errors=False  # Show errors for debugging
-)
-
-# Make limiter available globally for blueprints
-app.limiter = limiter
+# Bind the shared limiter; per-route limits are declared on the blueprint views
+from verikey.extensions import limiter
+app.config['RATELIMIT_STORAGE_URI'] = get_limiter_storage_uri()
+limiter.init_app(app)
 
 # Initialize database
 from verikey.models import db
@@ -110,86 +117,6 @@ def get_csrf_token():
     response.headers['X-CSRF-Token'] = token
     return response
 
-@app.route('/users/lookup', methods=['POST'])
-@limiter.limit("30 per minute")
-def lookup_user():
-    """Look up a user by email or username"""
-    from flask import request, jsonify
-    from verikey.models import User, db
-    from verikey.decorators import token_required
-    import jwt
-    
-    # CSRF protection for state-changing operations
-    if app.config['WTF_CSRF_ENABLED']:
-        csrf.protect()
-    
-    token = None
-    if 'Authorization' in request.headers:
-        auth_header = request.headers['Authorization']
-        try:
-            token = auth_header.split(' ')[1]
-        except IndexError:
-            return jsonify({'error': 'Invalid authorization header format'}), 401
-    
-    if not token:
-        return jsonify({'error': 'Authentication token is required'}), 401
-    
-    try:
-        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        current_user_id = data['user_id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
-    
-    # Get request data
-    request_data = request.get_json()
-    identifier = request_data.get('identifier', '').strip()
-    
-    if not identifier:
-        return jsonify({'error': 'Identifier is required'}), 400
-    
-    print(f"🔍 Looking up user: {identifier}")
-    
-    # Look up user
-    user = None
-    if identifier.startswith('@'):
-        # Username lookup
-        clean_identifier = identifier[1:].lower()
-        user = User.query.filter(
-            db.and_(
-                User.id != current_user_id,
-                User.screen_name == clean_identifier,
-                User.is_active == True
-            )
-        ).first()
-    else:
-        # Email lookup
-        user = User.query.filter(
-            db.and_(
-                User.id != current_user_id,
-                User.email == identifier.lower(),
-                User.is_active == True
-            )
-        ).first()
-    
-    if not user:
-        print(f"❌ User not found: {identifier}")
-        return jsonify({'error': 'User not found'}), 404
-    
-    print(f"✅ Found user: {user.screen_name or user.email}")
-    
-    return jsonify({
-        'user': {
-            'id': user.id,
-            'email': user.email,
-            'screen_name': user.screen_name,
-            'display_name': f"@{user.screen_name}" if user.screen_name else user.email,
-            'profile_image_url': user.profile_image_url,
-            'is_verified': user.is_verified or False
-        }
-    }), 200
-
 @app.route('/')
 def home():
     return jsonify({'message': 'Verikey API is running', 'status': 'healthy'})
@@ -1,11 +1,13 @@
 import email
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.exceptions import BadRequest
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
 import bcrypt
 import jwt
 import re
 from datetime import datetime, timedelta, timezone, date
+from verikey.extensions import limiter
 from verikey.models import db
 from verikey.models import User
 from verikey.models_auth import RefreshToken
@@ -13,9 +15,19 @@ from verikey.decorators import token_required
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+SCREEN_NAME_RE = re.compile(r'^[a-zA-Z0-9_.]+$')
+# Unique indexes a duplicate email or screen name can violate (column index and lower() index)
+EMAIL_CONSTRAINTS = frozenset({'ix_users_email', 'ix_users_email_lower'})
+SCREEN_NAME_CONSTRAINTS = frozenset({'ix_users_screen_name', 'ix_users_screen_name_lower'})
+
 def validate_email(email):
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    # RFC 5321 caps addresses at 254 characters; the length cap also bounds regex backtracking
+    if not email or len(email) > 254:
+        return False
+    # Cheap structural test first; most malformed input never reaches the regex
+    at = email.find('@')
+    return at > 0 and '.' in email[at + 1:] and EMAIL_RE.match(email) is not None
 
 def validate_password(password):
     if len(password) < 6:
@@ -31,12 +43,21 @@ def validate_screen_name(screen_name):
     if len(clean_name) < 3 or len(clean_name) > 30:
         return False, "Screen name must be between 3 and 30 characters"
     
-    username_regex = re.compile(r'^[a-zA-Z0-9_.]+$')
-    if not username_regex.match(clean_name):
+    if not SCREEN_NAME_RE.match(clean_name):
         return False, "Screen name can only contain letters, numbers, underscores, and dots"
     
     return True, clean_name
 
+def violated_constraint(error):
+    """Name of the constraint or index a psycopg2 IntegrityError violated, if reported"""
+    return getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+
+def user_exists(*criteria):
+    """Check for an active user matching criteria with a single EXISTS query"""
+    return db.session.execute(
+        db.select(db.exists().where(User.is_active == True, *criteria))
+    ).scalar()
+
 def generate_tokens(user_id, device_info=None):
     """Generate both access and refresh tokens"""
     try:
@@ -66,18 +87,9 @@ def generate_tokens(user_id, device_info=None):
         return None
 
 @auth_bp.route('/signup', methods=['POST'])
+@limiter.limit("5 per hour", override_defaults=False, error_message='5 signups per hour allowed')
 def signup():
     """Rate limited signup endpoint"""
-    # Apply rate limiting using decorator from app's limiter
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        # Decorate this function dynamically
-        limited = limiter.limit("5 per hour")(lambda: None)
-        try:
-            limited()
-        except Exception as e:
-            return {'error': 'Rate limit exceeded', 'message': '5 signups per hour allowed'}, 429
-    
     try:
         if not request.is_json:
             current_app.logger.warning("Signup attempt without JSON data")
@@ -87,7 +99,7 @@ def signup():
         if not data:
             return {'error': 'No data provided'}, 400
         
-        email = data.get('email', '').strip().lower()
+        email = (data.get('email') or '').strip().casefold()
         password = data.get('password', '')
         first_name = data.get('first_name', '').strip()
         last_name = data.get('last_name', '').strip()
@@ -118,14 +130,16 @@ def signup():
         elif len(last_name) < 2 or len(last_name) > 50:
             errors.append('Last name must be between 2 and 50 characters')
         
+        clean_screen_name = None
         if not screen_name:
             errors.append('Username is required')
         else:
-            is_valid, clean_screen_name = validate_screen_name(screen_name)
+            is_valid, message = validate_screen_name(screen_name)
             if not is_valid:
-                errors.append(clean_screen_name)
+                errors.append(message)
             else:
-                screen_name = clean_screen_name
+                # Lowercased, '@'-stripped form, as ix_users_screen_name_lower compares it
+                clean_screen_name = message
         
         date_of_birth = None
         age = None
@@ -154,17 +168,15 @@ def signup():
         
         db.session.begin()
         try:
-            existing_email = User.query.filter_by(email=email, is_active=True).first()
-            if existing_email:
+            if user_exists(db.func.lower(User.email) == email):
                 db.session.rollback()
                 current_app.logger.warning(f"Signup attempt with existing email: {email}")
                 # Don't reveal that email exists
                 return {'error': 'Registration failed. Please try with different credentials.'}, 409
             
-            existing_screen_name = User.query.filter_by(screen_name=screen_name, is_active=True).first()
-            if existing_screen_name:
+            if user_exists(db.func.lower(User.screen_name) == clean_screen_name):
                 db.session.rollback()
-                current_app.logger.warning(f"Signup attempt with existing screen_name: {screen_name}")
+                current_app.logger.warning(f"Signup attempt with existing screen_name: {clean_screen_name}")
                 return {'error': 'This username is already taken. Please choose another.'}, 409
             
             try:
@@ -179,12 +191,21 @@ def signup():
                 password=password_hash,
                 first_name=first_name,
                 last_name=last_name,
-                screen_name=screen_name,
+                screen_name=clean_screen_name,
                 date_of_birth=date_of_birth
             )
             
             db.session.add(new_user)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError as e:
+                # Lost a race with a concurrent signup for the same name or email
+                db.session.rollback()
+                constraint = violated_constraint(e)
+                current_app.logger.warning(f"Signup hit unique index {constraint} for @{clean_screen_name}")
+                if constraint in SCREEN_NAME_CONSTRAINTS:
+                    return {'error': 'This username is already taken. Please choose another.'}, 409
+                return {'error': 'Registration failed. Please try with different credentials.'}, 409
             
             # Generate tokens
             device_info = request.headers.get('User-Agent', 'Unknown')
@@ -193,7 +214,7 @@ def signup():
                 current_app.logger.error(f"User {new_user.id} created but token generation failed")
                 return {'error': 'Account created but login failed. Please try logging in.'}, 500
             
-            current_app.logger.info(f"✅ New user created with complete profile: {new_user.id} ({email}, @{screen_name})")
+            current_app.logger.info(f"✅ New user created with complete profile: {new_user.id} ({email}, @{clean_screen_name})")
             
             return {
                 'message': 'Account created successfully',
@@ -212,16 +233,9 @@ def signup():
         return {'error': 'Account creation failed. Please try again.'}, 500
 
 @auth_bp.route('/check-username', methods=['POST'])
+@limiter.limit("30 per minute", override_defaults=False)
 def check_username():
     """Rate limited username check"""
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded'}, 429
-    
     try:
         data = request.get_json()
         screen_name = data.get('screen_name', '').strip()
@@ -233,9 +247,7 @@ def check_username():
         if not is_valid:
             return {'available': False, 'error': clean_screen_name}, 400
         
-        existing = User.query.filter_by(screen_name=clean_screen_name, is_active=True).first()
-        
-        if existing:
+        if user_exists(db.func.lower(User.screen_name) == clean_screen_name):
             return {'available': False, 'error': 'Username already taken'}, 200
         
         return {'available': True, 'screen_name': clean_screen_name}, 200
@@ -245,17 +257,9 @@ def check_username():
         return {'error': 'Failed to check username'}, 500
 
 @auth_bp.route('/login', methods=['POST'])
+@limiter.limit("5 per minute", override_defaults=False, error_message='5 login attempts per minute allowed')
 def login():
     """Rate limited login endpoint"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("5 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '5 login attempts per minute allowed'}, 429
-    
     try:
         if not request.is_json:
             current_app.logger.warning("Login attempt without JSON data")
@@ -304,7 +308,7 @@ def login():
             return {'error': 'Invalid email/username or password'}, 401
         
         try:
-            if bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
+            if bcrypt.checkpw(password.encode('utf-8'), user.password_bytes):
                 # Generate tokens
                 device_info = request.headers.get('User-Agent', 'Unknown')
                 tokens = generate_tokens(user.id, device_info)
@@ -337,16 +341,9 @@ def login():
         return {'error': 'Login failed. Please try again.'}, 500
 
 @auth_bp.route('/refresh', methods=['POST'])
+@limiter.limit("10 per minute", override_defaults=False)
 def refresh_token():
     """New secure refresh token endpoint"""
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("10 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded'}, 429
-    
     try:
         data = request.get_json()
         if not data or 'refresh_token' not in data:
@@ -392,17 +389,10 @@ def refresh_token():
         return {'error': 'Token refresh failed'}, 500
 
 @auth_bp.route('/verify', methods=['GET'])
+@limiter.limit("30 per minute", override_defaults=False)
 @token_required
 def verify_token(current_user_id):
     """Verify access token"""
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded'}, 429
-    
     try:
         user = User.query.filter_by(id=current_user_id, is_active=True).first()
         if not user:
@@ -450,17 +440,10 @@ def logout_all_devices(current_user_id):
         return {'error': 'Failed to logout from all devices'}, 500
 
 @auth_bp.route('/users', methods=['GET'])
+@limiter.limit("30 per minute", override_defaults=False)
 @token_required
 def list_users(current_user_id):
     """List all active users"""
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded'}, 429
-    
     try:
         users = User.query.filter_by(is_active=True).all()
         
@@ -471,7 +454,7 @@ def list_users(current_user_id):
             'first_name': user.first_name,
             'last_name': user.last_name,
             'age': user.age,
-            'created_at': user.created_at.isoformat()
+            'created_at': user.created_at
         } for user in users]
         
         current_app.logger.info(f"User list requested by user {current_user_id}, returning {len(user_list)} active users")
@@ -0,0 +1,20 @@
+import os
+import redis
+
+_redis_client = None
+_redis_checked = False
+
+def get_redis():
+    """Get a Redis client for REDIS_URL, or None if Redis is not available"""
+    global _redis_client, _redis_checked
+    if not _redis_checked:
+        _redis_checked = True
+        redis_url = os.getenv('REDIS_URL')
+        if redis_url:
+            try:
+                client = redis.from_url(redis_url)
+                client.ping()
+                _redis_client = client
+            except redis.RedisError:
+                _redis_client = None
+    return _redis_client
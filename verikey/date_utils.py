@@ -112,7 +112,7 @@ def enhance_model_serialization():
             'label': self.label,
             'status': self.status,
             'notes': self.notes,
-            'information_types': self.get_information_types(),
+            'information_types': self.information_types or [],
             'requester_id': self.requester_id,
             'target_user_id': self.target_user_id,
             'target_email': self.target_email
@@ -1,7 +1,7 @@
 from functools import wraps
-from flask import request, current_app
+from flask import request, current_app, g
 import jwt
-from verikey.models import User
+from verikey.models import db, User
 
 def token_required(f):
     @wraps(f)
@@ -30,7 +30,7 @@ def token_required(f):
             
             current_user_id = data['user_id']
             
-            current_user = User.query.get(current_user_id)
+            current_user = db.session.get(User, current_user_id)
             if not current_user:
                 current_app.logger.warning(f"Token valid but user {current_user_id} no longer exists")
                 return {'error': 'User no longer exists'}, 401
@@ -39,6 +39,9 @@ def token_required(f):
                 current_app.logger.warning(f"Token valid but user {current_user_id} is inactive")
                 return {'error': 'User account is inactive'}, 401
             
+            # Handlers read the authenticated user from g instead of loading it again
+            g.current_user = current_user
+            
             current_app.logger.debug(f"Authenticated request from user {current_user_id}")
             
         except jwt.ExpiredSignatureError:
@@ -0,0 +1,10 @@
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+
+# Created unbound so blueprints can register limits at import time;
+# app.py attaches it with limiter.init_app(app)
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["200 per day", "50 per hour"],
+    swallow_errors=False  # Show errors for debugging
+)
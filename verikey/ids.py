@@ -0,0 +1,34 @@
+import os
+import threading
+import time
+
+_CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+def new_ulid():
+    """Return a 26-character ULID string.
+
+    ULIDs start with a millisecond timestamp, so ids generated later sort
+    after earlier ones and index inserts land at the right edge of the B-tree.
+    Ids from the same millisecond increment the random part to stay ordered.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            now_ms = _last_ms
+            _last_random = (_last_random + 1) & ((1 << _RANDOM_BITS) - 1)
+        else:
+            _last_ms = now_ms
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        value = (now_ms << _RANDOM_BITS) | _last_random
+
+    chars = []
+    for _ in range(26):
+        chars.append(_CROCKFORD[value & 0x1F])
+        value >>= 5
+    return ''.join(reversed(chars))
@@ -1,55 +1,44 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
+from sqlalchemy.orm import joinedload
+from verikey.extensions import limiter
 from verikey.models import db
 from verikey.models import User, ShareableKey
 from verikey.decorators import token_required
+from verikey.verification import validate_title, PHOTO_UPLOAD_SLOTS
+from verikey.services.s3_service import s3_service
 from datetime import datetime
-import uuid
-import json
+from verikey.ids import new_ulid
+import orjson
 
 keys_bp = Blueprint('keys', __name__)
 
-def validate_title(title: str) -> tuple[bool, str]:
-    if not title or not title.strip():
-        return False, "Title is required"
-    
-    title = title.strip()
-    
-    MIN_LENGTH = 3
-    MAX_LENGTH = 30
-    
-    if len(title) < MIN_LENGTH:
-        return False, f"Title must be at least {MIN_LENGTH} characters"
-    
-    if len(title) > MAX_LENGTH:
-        return False, f"Title must be no more than {MAX_LENGTH} characters"
-    
-    words = title.split()
-    if len(words) == 1 and len(title) > 20:
-        return False, "Title appears to be a single long word. Please use a descriptive title"
-    
-    MAX_WORD_LENGTH = 15
-    for word in words:
-        if len(word) > MAX_WORD_LENGTH:
-            return False, f"Individual words in title cannot exceed {MAX_WORD_LENGTH} characters"
-    
-    if not any(c.isalpha() for c in title):
-        return False, "Title must contain at least some letters"
-    
-    return True, ""
+# Signed GET URLs for key images outlive a single details view only briefly
+KEY_IMAGE_URL_EXPIRY = 300
+
+def key_user_data(key, viewable):
+    """user_data for a response, with stored image keys swapped for image_url.
+
+    The URL is a short-lived presigned GET, issued only when viewable and only
+    for objects under the key's own source request.
+    """
+    user_data = dict(key.user_data or {})
+    prefix = f"verification_{key.source_request_id}_" if key.source_request_id else None
+    for slot in PHOTO_UPLOAD_SLOTS:
+        image = user_data.get(slot)
+        if isinstance(image, dict) and 'image_key' in image:
+            image = dict(image)
+            image_key = image.pop('image_key')
+            image['image_url'] = None
+            if viewable and prefix and image_key and image_key.startswith(prefix):
+                image['image_url'] = s3_service.get_presigned_url(image_key, KEY_IMAGE_URL_EXPIRY)
+            user_data[slot] = image
+    return user_data
 
 @keys_bp.route('/keys', methods=['GET'])
+@limiter.limit("60 per minute", override_defaults=False, error_message='60 requests per minute allowed')
 @token_required
 def get_all_keys(current_user_id):
     """Get all keys for the current user"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("60 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '60 requests per minute allowed'}, 429
-    
     try:
         sent_keys = ShareableKey.query.filter_by(creator_id=current_user_id).order_by(ShareableKey.created_at.desc()).all()
         received_keys = ShareableKey.query.filter_by(recipient_user_id=current_user_id).order_by(ShareableKey.created_at.desc()).all()
@@ -66,7 +55,7 @@ def get_all_keys(current_user_id):
         
         sent_keys_ui = []
         for key in sent_keys:
-            recipient = User.query.get(key.recipient_user_id) if key.recipient_user_id else None
+            recipient = db.session.get(User, key.recipient_user_id) if key.recipient_user_id else None
             
             if key.is_shareable_link:
                 recipient_name = 'Shareable Link'
@@ -100,11 +89,11 @@ def get_all_keys(current_user_id):
                 'views_allowed': key.views_allowed,
                 'viewsRemaining': max(0, key.views_allowed - key.views_used) if key.views_allowed != 999 else 999,
                 'sentOn': sent_date,
-                'created_at': key.created_at.isoformat() if key.created_at else None,
+                'created_at': key.created_at,
                 'lastViewed': key.last_viewed_at.strftime('%m/%d/%Y at %I:%M %p') if key.last_viewed_at else 'Not Viewed',
-                'informationTypes': key.get_information_types(),
+                'informationTypes': key.information_types or [],
                 'notes': key.notes,
-                'user_data': key.get_user_data(),
+                'user_data': key_user_data(key, False),
                 'hasNoViewsLeft': key.status == 'viewed_out',
                 'badgeText': 'Viewed out' if key.status == 'viewed_out' else None,
                 'recipient': {
@@ -116,7 +105,7 @@ def get_all_keys(current_user_id):
         
         received_keys_ui = []
         for key in received_keys:
-            creator = User.query.get(key.creator_id)
+            creator = db.session.get(User, key.creator_id)
             
             if creator and creator.screen_name:
                 creator_name = f"@{creator.screen_name}"
@@ -155,10 +144,10 @@ def get_all_keys(current_user_id):
                 'views_allowed': key.views_allowed,
                 'viewsRemaining': max(0, key.views_allowed - key.views_used) if key.views_allowed != 999 else 999,
                 'receivedOn': received_date,
-                'created_at': key.created_at.isoformat() if key.created_at else None,
-                'informationTypes': key.get_information_types(),
+                'created_at': key.created_at,
+                'informationTypes': key.information_types or [],
                 'notes': key.notes,
-                'user_data': key.get_user_data(),
+                'user_data': key_user_data(key, False),
                 'isNew': is_new,
                 'hasNoViewsLeft': has_no_views_left,
                 'badgeText': badge_text,
@@ -183,18 +172,10 @@ def get_all_keys(current_user_id):
         return {'error': 'Failed to get keys'}, 500
 
 @keys_bp.route('/keys', methods=['POST'])
+@limiter.limit("20 per hour", override_defaults=False, error_message='20 keys per hour allowed')
 @token_required
 def create_shareable_key(current_user_id):
     """Create a new shareable key - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("20 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '20 keys per hour allowed'}, 429
-    
     try:
         data = request.get_json()
         current_app.logger.info(f"🚀 Creating key with data: {data}")
@@ -219,7 +200,7 @@ def create_shareable_key(current_user_id):
             recipient_email = data['recipient_email'].strip()
             recipient_user = User.query.filter_by(email=recipient_email, is_active=True).first()
         
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if not current_user:
             return {'error': 'User not found'}, 404
         
@@ -228,7 +209,7 @@ def create_shareable_key(current_user_id):
             views_allowed = 2
         
         new_key = ShareableKey(
-            key_uuid=str(uuid.uuid4()),
+            key_uuid=new_ulid(),
             creator_id=current_user_id,
             recipient_email=recipient_user.email if recipient_user else data.get('recipient_email'),
             recipient_user_id=recipient_user.id if recipient_user else None,
@@ -240,12 +221,13 @@ def create_shareable_key(current_user_id):
         )
         
         if isinstance(data['information_types'], list):
-            new_key.set_information_types(data['information_types'])
+            new_key.information_types = data['information_types']
         else:
             return {'error': 'Information types must be a list'}, 400
         
         user_data = {}
         information_types = data['information_types']
+        captured_at = datetime.utcnow().isoformat()
         
         for info_type in information_types:
             if info_type == 'fullname':
@@ -289,13 +271,13 @@ def create_shareable_key(current_user_id):
                     user_data['selfie'] = {
                         'status': 'captured',
                         'image_data': data['selfie_data'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 elif 'selfie_base64' in data:
                     user_data['selfie'] = {
                         'status': 'captured',
                         'image_data': data['selfie_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 elif 'user_data' in data and 'selfie' in data['user_data']:
                     user_data['selfie'] = data['user_data']['selfie']
@@ -309,13 +291,13 @@ def create_shareable_key(current_user_id):
                     user_data['photo'] = {
                         'status': 'captured',
                         'image_data': data['photo_data'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 elif 'photo_base64' in data:
                     user_data['photo'] = {
                         'status': 'captured',
                         'image_data': data['photo_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 elif 'user_data' in data and 'photo' in data['user_data']:
                     user_data['photo'] = data['user_data']['photo']
@@ -333,7 +315,7 @@ def create_shareable_key(current_user_id):
                 'message': 'This information has been verified via government ID'
             }
         
-        new_key.set_user_data(user_data)
+        new_key.user_data = user_data
         
         db.session.add(new_key)
         db.session.commit()
@@ -355,18 +337,10 @@ def create_shareable_key(current_user_id):
         return {'error': 'Failed to create key'}, 500
 
 @keys_bp.route('/verifications', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 verifications per hour allowed')
 @token_required
 def submit_verification_response(current_user_id):
     """Submit verification response - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 verifications per hour allowed'}, 429
-    
     try:
         data = request.get_json()
         request_id = data.get('request_id')
@@ -375,12 +349,12 @@ def submit_verification_response(current_user_id):
             return {'error': 'Request ID is required'}, 400
         
         from verikey.models import Request
-        verification_request = Request.query.get(request_id)
+        verification_request = db.session.get(Request, request_id, options=[joinedload(Request.requester)])
         
         if not verification_request:
             return {'error': 'Request not found'}, 404
         
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if not current_user:
             return {'error': 'User not found'}, 404
         
@@ -393,10 +367,11 @@ def submit_verification_response(current_user_id):
             views_allowed = 2
         
         new_key = ShareableKey(
-            key_uuid=str(uuid.uuid4()),
+            key_uuid=new_ulid(),
             creator_id=current_user_id,
             recipient_email=verification_request.requester.email,
             recipient_user_id=verification_request.requester_id,
+            source_request_id=verification_request.id,
             label=f"Response to: {verification_request.label}",
             views_allowed=views_allowed,
             is_shareable_link=False,
@@ -404,19 +379,22 @@ def submit_verification_response(current_user_id):
             status='active'
         )
         
-        new_key.set_information_types(verification_request.get_information_types())
+        information_types = verification_request.information_types or []
+        new_key.information_types = information_types
         
         user_data = {}
-        information_types = verification_request.get_information_types()
         
-        # Parse additional_data if it exists
-        additional_data = {}
-        if 'additional_data' in data and data['additional_data']:
+        # additional_data arrives either as an object or as a JSON-encoded string
+        additional_data = data.get('additional_data') or {}
+        if isinstance(additional_data, str):
             try:
-                additional_data = json.loads(data['additional_data'])
-            except json.JSONDecodeError:
+                additional_data = orjson.loads(additional_data)
+            except orjson.JSONDecodeError:
                 current_app.logger.warning(f"Failed to parse additional_data")
+                additional_data = {}
         
+        now = datetime.utcnow()
+        captured_at = now.isoformat()
         for info_type in information_types:
             if info_type == 'fullname':
                 if 'fullname' in additional_data:
@@ -460,14 +438,14 @@ def submit_verification_response(current_user_id):
                     user_data['selfie'] = {
                         'status': 'captured',
                         'image_data': data['selfie_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 elif 'photo_base64' in data and 'photo' not in information_types:
                     # Fallback: if only photo_base64 is sent and photo is not requested, use it for selfie
                     user_data['selfie'] = {
                         'status': 'captured',
                         'image_data': data['photo_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 else:
                     user_data['selfie'] = {
@@ -479,7 +457,7 @@ def submit_verification_response(current_user_id):
                     user_data['photo'] = {
                         'status': 'captured',
                         'image_data': data['photo_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
+                        'captured_at': captured_at
                     }
                 else:
                     user_data['photo'] = {
@@ -493,13 +471,17 @@ def submit_verification_response(current_user_id):
                 'message': 'This information has been verified via government ID'
             }
         
-        new_key.set_user_data(user_data)
+        new_key.user_data = user_data
         
         db.session.add(new_key)
         
         verification_request.status = 'completed'
-        verification_request.response_at = datetime.utcnow()
+        verification_request.response_at = now
         
+        # One flush writes the key and the request; reading the ids before commit
+        # avoids the refresh SELECT that expire_on_commit would trigger
+        db.session.flush()
+        key_id, key_uuid = new_key.id, new_key.key_uuid
         db.session.commit()
         
         current_app.logger.info(f"✅ Verification response submitted: Request {request_id} by user {current_user_id}")
@@ -508,8 +490,8 @@ def submit_verification_response(current_user_id):
         
         return {
             'message': 'Verification response submitted successfully',
-            'key_id': new_key.id,
-            'key_uuid': new_key.key_uuid
+            'key_id': key_id,
+            'key_uuid': key_uuid
         }, 201
         
     except Exception as e:
@@ -518,18 +500,10 @@ def submit_verification_response(current_user_id):
         return {'error': 'Failed to submit verification response'}, 500
 
 @keys_bp.route('/keys/<int:key_id>/details', methods=['GET'])
+@limiter.limit("60 per minute", override_defaults=False, error_message='60 requests per minute allowed')
 @token_required
 def get_key_details(current_user_id, key_id):
     """Get key details - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("60 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '60 requests per minute allowed'}, 429
-    
     try:
         key = ShareableKey.query.filter(
             db.and_(
@@ -544,6 +518,9 @@ def get_key_details(current_user_id, key_id):
         if not key:
             return {'error': 'Key not found or access denied'}, 404
         
+        # Images are only signed for the creator or for a view recorded on an active key
+        viewable = key.creator_id == current_user_id or key.status == 'active'
+        
         # Check if viewing is allowed for unlimited views (999)
         if key.recipient_user_id == current_user_id:
             if key.views_allowed != 999 and key.status == 'viewed_out' and key.views_used >= key.views_allowed:
@@ -574,10 +551,10 @@ def get_key_details(current_user_id, key_id):
                 db.session.commit()
                 current_app.logger.info(f"👁 View recorded for key {key_id}: {key.views_used}/{key.views_allowed if key.views_allowed != 999 else 'unlimited'}")
         
-        creator = User.query.get(key.creator_id)
-        recipient = User.query.get(key.recipient_user_id) if key.recipient_user_id else None
+        creator = db.session.get(User, key.creator_id)
+        recipient = db.session.get(User, key.recipient_user_id) if key.recipient_user_id else None
         
-        user_data = key.get_user_data()
+        user_data = key_user_data(key, viewable)
         
         # Ensure location data is properly formatted
         if user_data and 'location' in user_data and isinstance(user_data['location'], dict):
@@ -593,15 +570,15 @@ def get_key_details(current_user_id, key_id):
             'key_uuid': key.key_uuid,
             'label': key.label,
             'status': key.status,
-            'information_types': key.get_information_types(),
+            'information_types': key.information_types or [],
             'user_data': user_data,
             'views_used': key.views_used,
             'views_allowed': key.views_allowed,
             'views_remaining': 'Unlimited' if key.views_allowed == 999 else max(0, key.views_allowed - key.views_used),
             'is_shareable_link': key.is_shareable_link,
             'notes': key.notes,
-            'created_at': key.created_at.isoformat() if key.created_at else None,
-            'last_viewed_at': key.last_viewed_at.isoformat() if key.last_viewed_at else None,
+            'created_at': key.created_at,
+            'last_viewed_at': key.last_viewed_at,
             'creator': {
                 'id': creator.id,
                 'name': f"{creator.first_name} {creator.last_name}" if creator.first_name else creator.email,
@@ -625,18 +602,10 @@ def get_key_details(current_user_id, key_id):
         return {'error': 'Failed to get key details'}, 500
 
 @keys_bp.route('/keys/<int:key_id>/revoke', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def revoke_key(current_user_id, key_id):
     """Revoke a key - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
         key = ShareableKey.query.filter_by(
             id=key_id,
@@ -664,18 +633,10 @@ def revoke_key(current_user_id, key_id):
         return {'error': 'Failed to revoke key'}, 500
 
 @keys_bp.route('/keys/<int:key_id>', methods=['DELETE'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def delete_key(current_user_id, key_id):
     """Delete a key - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
         sent_key = ShareableKey.query.filter_by(
             id=key_id,
@@ -716,18 +677,10 @@ def delete_key(current_user_id, key_id):
         return {'error': 'Failed to delete key'}, 500
 
 @keys_bp.route('/keys/new-count', methods=['GET'])
+@limiter.limit("60 per minute", override_defaults=False, error_message='60 requests per minute allowed')
 @token_required
 def get_new_keys_count(current_user_id):
     """Get count of new keys - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("60 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '60 requests per minute allowed'}, 429
-    
     try:
         new_keys_count = ShareableKey.query.filter_by(
             recipient_user_id=current_user_id,
@@ -744,18 +697,10 @@ def get_new_keys_count(current_user_id):
         return {'error': 'Failed to get new keys count'}, 500
 
 @keys_bp.route('/keys/<int:key_id>/remove', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def remove_received_key(current_user_id, key_id):
     """Remove a received key - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
         key = ShareableKey.query.filter_by(
             id=key_id,
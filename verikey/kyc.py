@@ -1,15 +1,35 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from datetime import datetime
-import uuid
-import json
 import base64
 import io
 from verikey.models import db, User, KYCVerification
 from verikey.decorators import token_required
-from verikey.services.s3_service import s3_service
+from verikey.ids import new_ulid
+from verikey.services.s3_service import s3_service, UPLOAD_EXT
+from verikey.extensions import limiter
 
 kyc_bp = Blueprint('kyc', __name__)
 
+UPLOAD_URL_EXPIRY = 900
+
+KYC_UPLOAD_SLOTS = {
+    'id_front': ('front', 'id_front_url'),
+    'id_back': ('back', 'id_back_url'),
+    'selfie': ('selfie', 'selfie_url'),
+}
+
+_NEXT_STEPS = {
+    'pending_upload': "Upload your document photos to continue.",
+    'pending': "Your verification is in the queue for processing.",
+    'processing': "Your verification is currently being processed.",
+    'needs_review': "Your verification requires manual review.",
+    'approved': "Your identity has been successfully verified!",
+    'rejected': "Your verification was rejected. You can retry with clearer photos.",
+}
+
+def kyc_object_key(verification_id, suffix):
+    return f"kyc_{verification_id}_{suffix}.{UPLOAD_EXT}"
+
 def process_image_upload(image_data):
     try:
         if not image_data:
@@ -29,6 +49,7 @@ def process_image_upload(image_data):
         return None
 
 @kyc_bp.route('/kyc/verify', methods=['POST'])
+@limiter.limit("5 per hour", override_defaults=False, error_message='5 verification submissions per hour allowed')
 @token_required
 def submit_kyc_verification(current_user_id):
     try:
@@ -44,18 +65,21 @@ def submit_kyc_verification(current_user_id):
             if field not in data:
                 return {'error': f'{field} is required'}, 400
                 
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
             
         existing_verification = KYCVerification.query.filter_by(
             user_id=current_user_id
-        ).filter(KYCVerification.status.in_(['pending', 'processing', 'approved', 'needs_review'])).first()
+        ).filter(KYCVerification.status.in_(['pending_upload', 'pending', 'processing', 'approved', 'needs_review'])).first()
         
         if existing_verification:
-            return {'error': f'You already have a {existing_verification.status} verification'}, 409
+            if existing_verification.status != 'pending_upload':
+                return {'error': f'You already have a {existing_verification.status} verification'}, 409
+            # An abandoned upload session is replaced by the new one
+            existing_verification.status = 'superseded'
             
-        verification_id = str(uuid.uuid4())
+        verification_id = new_ulid()
         kyc_verification = KYCVerification(
             user_id=current_user_id,
             verification_id=verification_id,
@@ -63,7 +87,31 @@ def submit_kyc_verification(current_user_id):
             status='needs_review'
         )
         
-        kyc_verification.set_manual_data(data['manual_data'])
+        kyc_verification.manual_data = data['manual_data'] or None
+        
+        has_inline_images = any(data.get(field) for field in ('id_front_image', 'id_back_image', 'verification_selfie'))
+        
+        if not has_inline_images:
+            # Client uploads straight to S3 and then calls /kyc/finalize
+            kyc_verification.status = 'pending_upload'
+            
+            uploads = {}
+            for slot, (suffix, _) in KYC_UPLOAD_SLOTS.items():
+                post = s3_service.presign_post(kyc_object_key(verification_id, suffix), UPLOAD_URL_EXPIRY)
+                if not post:
+                    db.session.rollback()
+                    return {'error': 'Failed to prepare document upload'}, 500
+                uploads[slot] = {'url': post['url'], 'fields': post['fields']}
+            
+            db.session.add(kyc_verification)
+            db.session.commit()
+            
+            return {
+                'message': 'Upload your documents, then finalize the verification.',
+                'verification_id': verification_id,
+                'uploads': uploads,
+                'expires_in': UPLOAD_URL_EXPIRY
+            }, 201
         
         image_urls = {}
         
@@ -105,11 +153,56 @@ def submit_kyc_verification(current_user_id):
         current_app.logger.error(f"KYC submission failed: {str(e)}")
         return {'error': 'Failed to process verification'}, 500
 
+@kyc_bp.route('/kyc/finalize', methods=['POST'])
+@limiter.limit("5 per hour", override_defaults=False, error_message='5 verification submissions per hour allowed')
+@token_required
+def finalize_kyc_verification(current_user_id):
+    try:
+        data = request.get_json()
+        verification_id = data.get('verification_id') if data else None
+        if not verification_id:
+            return {'error': 'verification_id is required'}, 400
+            
+        kyc_verification = KYCVerification.query.filter_by(
+            verification_id=verification_id,
+            user_id=current_user_id
+        ).first()
+        
+        if not kyc_verification:
+            return {'error': 'Verification not found'}, 404
+            
+        if kyc_verification.status != 'pending_upload':
+            return {'error': f'Cannot finalize a {kyc_verification.status} verification'}, 400
+            
+        images_uploaded = []
+        for slot, (suffix, url_field) in KYC_UPLOAD_SLOTS.items():
+            key = s3_service.finalize_upload(kyc_object_key(verification_id, suffix))
+            if key:
+                setattr(kyc_verification, url_field, s3_service.object_url(key))
+                images_uploaded.append(slot)
+                
+        if not images_uploaded:
+            return {'error': 'No documents have been uploaded yet'}, 400
+            
+        kyc_verification.status = 'needs_review'
+        db.session.commit()
+        
+        return {
+            'message': 'KYC verification submitted successfully. Your submission will be reviewed.',
+            'verification': kyc_verification.to_dict(),
+            'images_uploaded': images_uploaded
+        }, 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"KYC finalize failed: {str(e)}")
+        return {'error': 'Failed to finalize verification'}, 500
+
 @kyc_bp.route('/kyc/status', methods=['GET'])
 @token_required
 def get_kyc_status(current_user_id):
     try:
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
             
@@ -161,16 +254,4 @@ def retry_kyc_verification(current_user_id):
         return {'error': 'Failed to process retry'}, 500
 
 def get_next_steps(status):
-    if status == 'pending':
-        return "Your verification is in the queue for processing."
-    elif status == 'processing':
-        return "Your verification is currently being processed."
-    elif status == 'needs_review':
-        return "Your verification requires manual review."
-    elif status == 'approved':
-        return "Your identity has been successfully verified!"
-    elif status == 'rejected':
-        return "Your verification was rejected. You can retry with clearer photos."
-    else:
-        return "Unknown status."
-    
+    return _NEXT_STEPS.get(status, "Unknown status.")
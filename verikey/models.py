@@ -1,9 +1,13 @@
-from datetime import datetime, timezone, date
-import json
+from datetime import datetime, timezone, date, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import validates
+from verikey.services.s3_service import s3_service
 
 db = SQLAlchemy()
 
+_SIX_MONTHS = timedelta(days=180)
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -26,7 +30,7 @@ class User(db.Model):
     verification_level = db.Column(db.String(20), nullable=True)
     verification_method = db.Column(db.String(80), nullable=True)
     
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
     last_login = db.Column(db.DateTime, nullable=True)
     profile_image_url = db.Column(db.String(500), nullable=True)
     
@@ -35,9 +39,9 @@ class User(db.Model):
     deletion_reason = db.Column(db.String(255), nullable=True)
     
     sent_requests = db.relationship('Request', foreign_keys='Request.requester_id', 
-        backref='requester', cascade='all, delete-orphan')
+        back_populates='requester', cascade='all, delete-orphan')
     received_requests = db.relationship('Request', foreign_keys='Request.target_user_id', 
-        backref='target_user', cascade='all, delete-orphan')
+        back_populates='target_user', cascade='all, delete-orphan')
     created_keys = db.relationship('ShareableKey', foreign_keys='ShareableKey.creator_id',
         backref='creator', cascade='all, delete-orphan')
     received_keys = db.relationship('ShareableKey', foreign_keys='ShareableKey.recipient_user_id',
@@ -45,24 +49,24 @@ class User(db.Model):
     kyc_verifications = db.relationship('KYCVerification', backref='user', cascade='all, delete-orphan')
     
     __table_args__ = (
-        db.Index('idx_user_email_active', 'email', 'is_active'),
-        db.Index('idx_user_screen_name_active', 'screen_name', 'is_active'),
+        db.Index('ix_users_screen_name_lower', db.func.lower(screen_name).label('screen_name_lower'),
+                 unique=True,
+                 postgresql_ops={'screen_name_lower': 'text_pattern_ops'},
+                 postgresql_where=(is_active == True)),
+        db.Index('ix_users_email_lower', db.func.lower(email), unique=True,
+                 postgresql_where=(is_active == True)),
     )
     
-    def __setattr__(self, name, value):
-        protected_fields = ['first_name', 'last_name', 'date_of_birth']
-        
-        if name in protected_fields:
-            if hasattr(self, '_sa_instance_state') and self._sa_instance_state.has_identity:
-                if not getattr(self, '_allow_verification_update', False):
-                    current_value = getattr(self, name, None)
-                    if current_value is not None and current_value != value:
-                        raise ValueError(
-                            f"Cannot modify {name} after account creation. "
-                            f"This field can only be updated through the verification process."
-                        )
-        
-        super().__setattr__(name, value)
+    @validates('first_name', 'last_name', 'date_of_birth')
+    def _protect_pii(self, key, value):
+        if self._sa_instance_state.has_identity and not getattr(self, '_allow_verification_update', False):
+            current_value = getattr(self, key)
+            if current_value is not None and current_value != value:
+                raise ValueError(
+                    f"Cannot modify {key} after account creation. "
+                    f"This field can only be updated through the verification process."
+                )
+        return value
     
     def update_verified_info(self, first_name=None, last_name=None, date_of_birth=None,
                            verification_level=None, verification_method=None):
@@ -104,11 +108,25 @@ class User(db.Model):
             return None
             
         today = date.today()
-        age = today.year - dob.year
-        if today.month < dob.month or (today.month == dob.month and today.day < dob.day):
-            age -= 1
+        cached = self.__dict__.get('_age_cache')
+        if cached and cached[0] == today and cached[1] == dob:
+            return cached[2]
+        
+        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+        self.__dict__['_age_cache'] = (today, dob, age)
         return age
     
+    @property
+    def password_bytes(self):
+        password = self.password
+        cached = self.__dict__.get('_password_bytes')
+        if cached and cached[0] is password:
+            return cached[1]
+        
+        encoded = password.encode('ascii')
+        self.__dict__['_password_bytes'] = (password, encoded)
+        return encoded
+    
     @property
     def display_first_name(self):
         if self.is_verified and self.verified_first_name:
@@ -125,14 +143,17 @@ class User(db.Model):
     def display_full_name(self):
         return f"{self.display_first_name} {self.display_last_name}"
     
-    def can_change_screen_name(self):
-        if not self.last_screen_name_change:
+    def can_change_screen_name(self, now=None):
+        last_change = self.last_screen_name_change
+        if not last_change:
             return True
         
-        months_since_change = (datetime.now(timezone.utc) - self.last_screen_name_change).days / 30
-        return months_since_change >= 6
+        if last_change.tzinfo is None:
+            last_change = last_change.replace(tzinfo=timezone.utc)
+        
+        return last_change <= (now or datetime.now(timezone.utc)) - _SIX_MONTHS
     
-    def to_dict(self):
+    def to_dict(self, now=None):
         return {
             'id': self.id,
             'email': self.email,
@@ -141,18 +162,18 @@ class User(db.Model):
             'last_name': self.display_last_name,
             'full_name': self.display_full_name,
             'age': self.age,
-            'date_of_birth': self.date_of_birth.isoformat() if self.date_of_birth else None,
+            'date_of_birth': self.date_of_birth,
             'is_verified': self.is_verified,
             'verified_first_name': self.verified_first_name,
             'verified_last_name': self.verified_last_name,
-            'verified_date_of_birth': self.verified_date_of_birth.isoformat() if self.verified_date_of_birth else None,
-            'verified_at': self.verified_at.isoformat() if self.verified_at else None,
+            'verified_date_of_birth': self.verified_date_of_birth,
+            'verified_at': self.verified_at,
             'verification_level': self.verification_level,
             'verification_method': self.verification_method,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'profile_image_url': self.profile_image_url,
-            'can_change_screen_name': self.can_change_screen_name(),
-            'last_screen_name_change': self.last_screen_name_change.isoformat() if self.last_screen_name_change else None,
+            'created_at': self.created_at,
+            'profile_image_url': s3_service.profile_photo_url(self.id, self.profile_image_url),
+            'can_change_screen_name': self.can_change_screen_name(now),
+            'last_screen_name_change': self.last_screen_name_change,
             'profile_completed': True
         }
     
@@ -175,27 +196,27 @@ class Request(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     requester_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     target_user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
-    target_email = db.Column(db.String(120), nullable=False, index=True)
+    target_email = db.Column(db.String(120), nullable=False)
     label = db.Column(db.String(120), nullable=False)
     notes = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), default='pending', index=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
     response_at = db.Column(db.DateTime, nullable=True)
-    information_types = db.Column(db.Text, nullable=True)
+    information_types = db.Column(JSONB, nullable=True)
+    
+    # Declared here rather than as backrefs so the request list queries can joinedload them
+    requester = db.relationship('User', foreign_keys=[requester_id], back_populates='sent_requests')
+    target_user = db.relationship('User', foreign_keys=[target_user_id], back_populates='received_requests')
     
     __table_args__ = (
         db.Index('idx_request_requester_status', 'requester_id', 'status'),
         db.Index('idx_request_target_status', 'target_user_id', 'status'),
+        # GET /requests lists only open requests, newest first, paged on (created_at, id)
+        db.Index('ix_req_target_created', 'target_email', 'created_at', 'id',
+                 postgresql_where=(status != 'completed')),
+        db.Index('ix_req_requester_created', 'requester_id', 'created_at', 'id',
+                 postgresql_where=(status != 'completed')),
     )
-    
-    def set_information_types(self, info_types):
-        self.information_types = json.dumps(info_types)
-    
-    def get_information_types(self):
-        try:
-            return json.loads(self.information_types) if self.information_types else []
-        except json.JSONDecodeError:
-            return []
 
 
 class ShareableKey(db.Model):
@@ -206,40 +227,25 @@ class ShareableKey(db.Model):
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     recipient_user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     recipient_email = db.Column(db.String(120), nullable=True, index=True)
+    source_request_id = db.Column(db.Integer, db.ForeignKey('requests.id', ondelete='SET NULL'), nullable=True, index=True)
     label = db.Column(db.String(120), nullable=False)
     notes = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), default='active', index=True)
     views_allowed = db.Column(db.Integer, default=1)
     views_used = db.Column(db.Integer, default=0)
     is_shareable_link = db.Column(db.Boolean, default=False)
-    information_types = db.Column(db.Text, nullable=True)
-    user_data = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    information_types = db.Column(JSONB, nullable=True)
+    user_data = db.Column(JSONB, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
     last_viewed_at = db.Column(db.DateTime, nullable=True)
     
     __table_args__ = (
         db.Index('idx_key_creator_status', 'creator_id', 'status'),
         db.Index('idx_key_recipient_status', 'recipient_user_id', 'status'),
+        db.Index('ix_key_creator_recipient', 'creator_id', 'recipient_user_id'),
+        db.Index('idx_key_info_gin', 'information_types', postgresql_using='gin'),
     )
     
-    def set_information_types(self, info_types):
-        self.information_types = json.dumps(info_types)
-    
-    def get_information_types(self):
-        try:
-            return json.loads(self.information_types) if self.information_types else []
-        except json.JSONDecodeError:
-            return []
-    
-    def set_user_data(self, data_dict):
-        self.user_data = json.dumps(data_dict)
-    
-    def get_user_data(self):
-        try:
-            return json.loads(self.user_data) if self.user_data else {}
-        except json.JSONDecodeError:
-            return {}
-    
     def to_dict(self, include_user_data=False):
         result = {
             'id': self.id,
@@ -250,13 +256,13 @@ class ShareableKey(db.Model):
             'views_allowed': self.views_allowed,
             'views_used': self.views_used,
             'is_shareable_link': self.is_shareable_link,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_viewed_at': self.last_viewed_at.isoformat() if self.last_viewed_at else None,
-            'information_types': self.get_information_types()
+            'created_at': self.created_at,
+            'last_viewed_at': self.last_viewed_at,
+            'information_types': self.information_types or []
         }
         
         if include_user_data:
-            result['user_data'] = self.get_user_data()
+            result['user_data'] = self.user_data or {}
         
         return result
 
@@ -271,14 +277,14 @@ class KYCVerification(db.Model):
     id_front_url = db.Column(db.String(500), nullable=True)
     id_back_url = db.Column(db.String(500), nullable=True)
     selfie_url = db.Column(db.String(500), nullable=True)
-    manual_data = db.Column(db.Text, nullable=True)
+    manual_data = db.Column(JSONB, nullable=True)
     status = db.Column(db.String(20), default='pending', index=True)
     reviewer_notes = db.Column(db.Text, nullable=True)
     reviewed_by = db.Column(db.Integer, nullable=True)
     reviewed_at = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), 
-                          onupdate=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(),
+                          onupdate=db.func.now())
     expires_at = db.Column(db.DateTime, nullable=True)
     
     __table_args__ = (
@@ -288,26 +294,15 @@ class KYCVerification(db.Model):
     def __repr__(self):
         return f'<KYCVerification {self.verification_id}: {self.status}>'
     
-    def get_manual_data(self):
-        if self.manual_data:
-            try:
-                return json.loads(self.manual_data)
-            except json.JSONDecodeError:
-                return {}
-        return {}
-    
-    def set_manual_data(self, data_dict):
-        self.manual_data = json.dumps(data_dict) if data_dict else None
-    
     def to_dict(self, include_sensitive=False):
         result = {
             'id': self.id,
             'verification_id': self.verification_id,
             'document_type': self.document_type,
             'status': self.status,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
-            'manual_data': self.get_manual_data(),
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'manual_data': self.manual_data or {},
         }
         
         if include_sensitive:
@@ -316,7 +311,7 @@ class KYCVerification(db.Model):
                 'id_back_url': self.id_back_url,
                 'selfie_url': self.selfie_url,
                 'reviewer_notes': self.reviewer_notes,
-                'reviewed_at': self.reviewed_at.isoformat() if self.reviewed_at else None,
+                'reviewed_at': self.reviewed_at,
             })
         
         return result
\ No newline at end of file
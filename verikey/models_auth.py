@@ -9,13 +9,13 @@ class RefreshToken(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     token = db.Column(db.String(256), unique=True, nullable=False, index=True)
     expires_at = db.Column(db.DateTime, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     revoked = db.Column(db.Boolean, default=False)
     device_info = db.Column(db.String(256), nullable=True)  # Optional: track device/browser
     
     __table_args__ = (
         db.Index('idx_refresh_token_user', 'user_id', 'revoked'),
-        db.Index('idx_refresh_token_expires', 'expires_at', 'revoked'),
+        db.Index('idx_refresh_token_expires', 'expires_at', 'revoked', 'created_at'),
     )
     
     @classmethod
@@ -82,11 +82,12 @@ class RefreshToken(db.Model):
     @classmethod
     def cleanup_expired_tokens(cls):
         """Remove expired and revoked tokens (run periodically)"""
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=30)
-        cls.query.filter(
+        now = db.func.now()
+        stmt = db.delete(cls).where(
             db.or_(
-                cls.expires_at < datetime.now(timezone.utc),
-                db.and_(cls.revoked == True, cls.created_at < cutoff_date)
+                cls.expires_at < now,
+                db.and_(cls.revoked == True, cls.created_at < now - timedelta(days=30))
             )
-        ).delete()
+        ).execution_options(synchronize_session=False)
+        db.session.execute(stmt)
         db.session.commit()
\ No newline at end of file
@@ -1,29 +1,30 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
+from verikey.extensions import limiter
 from verikey.models import db
 from verikey.models import User, ShareableKey, Request, KYCVerification
 from verikey.decorators import token_required
+from verikey.auth import (
+    validate_email, validate_screen_name, user_exists,
+    violated_constraint, EMAIL_CONSTRAINTS, SCREEN_NAME_CONSTRAINTS
+)
+from verikey.services.s3_service import s3_service
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone, timedelta
 import bcrypt
+import logging
 import uuid
-import re
 
 profile_bp = Blueprint('profile', __name__)
 
+MAX_PROFILE_PHOTO_BYTES = 100000
+
 @profile_bp.route('/profile', methods=['GET'])
+@limiter.limit("60 per minute", override_defaults=False, error_message='60 requests per minute allowed')
 @token_required
 def get_profile(current_user_id):
     """Get user profile - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("60 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '60 requests per minute allowed'}, 429
-    
     try:
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
         
@@ -36,20 +37,12 @@ def get_profile(current_user_id):
         return {'error': 'Failed to get profile'}, 500
 
 @profile_bp.route('/profile', methods=['POST'])
+@limiter.limit("10 per hour", override_defaults=False, error_message='10 profile updates per hour allowed')
 @token_required
 def update_profile(current_user_id):
     """Update user profile - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("10 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '10 profile updates per hour allowed'}, 429
-    
     try:
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
         
@@ -68,22 +61,15 @@ def update_profile(current_user_id):
                 'attempted_fields': attempted_changes
             }, 403
         
+        values = {}
+        
         if 'email' in data:
-            new_email = data['email'].strip().lower() if data['email'] else None
+            new_email = data['email'].strip().casefold() if data['email'] else None
             if new_email and new_email != user.email:
-                existing = User.query.filter(
-                    User.email == new_email,
-                    User.id != current_user_id,
-                    User.is_active == True
-                ).first()
-                if existing:
-                    return {'error': 'Email already taken'}, 400
-                
-                email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-                if not re.match(email_pattern, new_email):
+                if not validate_email(new_email):
                     return {'error': 'Invalid email format'}, 400
                 
-                user.email = new_email
+                values['email'] = new_email
         
         if 'screen_name' in data:
             new_screen_name = data['screen_name'].strip() if data['screen_name'] else None
@@ -94,42 +80,58 @@ def update_profile(current_user_id):
                     if not user.can_change_screen_name():
                         return {
                             'error': 'You can only change your username once every 6 months',
-                            'last_change': user.last_screen_name_change.isoformat() if user.last_screen_name_change else None,
-                            'next_available': (user.last_screen_name_change + timedelta(days=180)).isoformat() if user.last_screen_name_change else None
+                            'last_change': user.last_screen_name_change,
+                            'next_available': user.last_screen_name_change + timedelta(days=180) if user.last_screen_name_change else None
                         }, 403
                     
-                    existing = User.query.filter(
-                        User.screen_name == new_screen_name,
-                        User.id != current_user_id,
-                        User.is_active == True
-                    ).first()
-                    if existing:
-                        return {'error': 'Username already taken'}, 400
-                    
-                    if len(new_screen_name) < 3 or len(new_screen_name) > 30:
-                        return {'error': 'Username must be between 3 and 30 characters'}, 400
+                    is_valid, message = validate_screen_name(new_screen_name)
+                    if not is_valid:
+                        return {'error': message}, 400
                     
-                    username_regex = re.compile(r'^[a-zA-Z0-9_.]+$')
-                    if not username_regex.match(new_screen_name):
-                        return {'error': 'Username can only contain letters, numbers, underscores, and dots'}, 400
-                    
-                    user.screen_name = new_screen_name
-                    user.last_screen_name_change = datetime.now(timezone.utc)
-                    current_app.logger.info(f"User {current_user_id} changed screen name to @{new_screen_name}")
-        
-        if 'profile_image_url' in data:
-            user.profile_image_url = data['profile_image_url']
-        
-        if 'bio' in data:
-            user.bio = data['bio'].strip() if data['bio'] else None
-        
-        db.session.commit()
-        
-        current_app.logger.info(f"✅ Profile updated for user {current_user_id}")
+                    values['screen_name'] = new_screen_name
+                    values['last_screen_name_change'] = datetime.now(timezone.utc)
+        
+        # A resubmitted signed URL for the stored S3 key is not a change
+        submitted_image = data.get('profile_image_url')
+        if ('profile_image_url' in data and submitted_image != user.profile_image_url
+                and not (user.profile_image_url and isinstance(submitted_image, str)
+                         and submitted_image.partition('?')[0].endswith('/' + user.profile_image_url))):
+            values['profile_image_url'] = submitted_image
+        
+        profile = user.to_dict()
+        
+        # Clients resubmit the whole profile; skip the round-trip when nothing differs
+        if values:
+            # Uniqueness of email and screen name is enforced by the database
+            try:
+                db.session.execute(
+                    db.update(User)
+                    .where(User.id == current_user_id)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                # The message text includes the conflicting value, so match on the index name
+                constraint = violated_constraint(e)
+                if constraint in EMAIL_CONSTRAINTS:
+                    return {'error': 'Email already taken'}, 400
+                if constraint in SCREEN_NAME_CONSTRAINTS:
+                    return {'error': 'Username already taken'}, 400
+                raise
+            
+            # Build the response from what was written instead of reloading the row
+            profile.update(values)
+            if 'screen_name' in values:
+                profile['can_change_screen_name'] = False
+                current_app.logger.info(f"User {current_user_id} changed screen name to @{values['screen_name']}")
+            
+            current_app.logger.info(f"✅ Profile updated for user {current_user_id}")
         
         return {
             'message': 'Profile updated successfully',
-            'profile': user.to_dict()
+            'profile': profile
         }, 200
         
     except Exception as e:
@@ -138,20 +140,16 @@ def update_profile(current_user_id):
         return {'error': 'Failed to update profile'}, 500
 
 @profile_bp.route('/profile/photo', methods=['POST'])
+@limiter.limit("20 per hour", override_defaults=False, error_message='20 photo updates per hour allowed')
 @token_required
 def update_profile_photo(current_user_id):
     """Update profile photo - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("20 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '20 photo updates per hour allowed'}, 429
+    # Reject oversized bodies before reading and parsing them
+    if request.content_length and request.content_length > MAX_PROFILE_PHOTO_BYTES + 1024:
+        return {'error': 'Photo too large. Please use a smaller image.'}, 400
     
     try:
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
         
@@ -161,9 +159,14 @@ def update_profile_photo(current_user_id):
             photo_data = data['profile_photo_url']
             
             if photo_data and photo_data.startswith('data:image'):
-                if len(photo_data) > 100000:
+                if len(photo_data) > MAX_PROFILE_PHOTO_BYTES:
                     return {'error': 'Photo too large. Please use a smaller image.'}, 400
-                user.profile_image_url = photo_data
+                
+                # Keep image bytes out of the users row; only the S3 key is stored
+                photo_key = s3_service.upload_profile_photo(photo_data, current_user_id)
+                if not photo_key:
+                    return {'error': 'Failed to upload profile photo'}, 500
+                user.profile_image_url = photo_key
             else:
                 user.profile_image_url = photo_data
             
@@ -173,7 +176,7 @@ def update_profile_photo(current_user_id):
             
             return {
                 'message': 'Profile photo updated successfully',
-                'profile_image_url': user.profile_image_url
+                'profile_image_url': s3_service.profile_photo_url(user.id, user.profile_image_url)
             }, 200
         
         return {'error': 'No photo data provided'}, 400
@@ -184,18 +187,10 @@ def update_profile_photo(current_user_id):
         return {'error': 'Failed to update profile photo'}, 500
 
 @profile_bp.route('/profile/check-screen-name', methods=['POST'])
+@limiter.limit("30 per minute", override_defaults=False, error_message='30 checks per minute allowed')
 @token_required
 def check_screen_name(current_user_id):
     """Check screen name availability - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 checks per minute allowed'}, 429
-    
     try:
         data = request.get_json()
         screen_name = data.get('screen_name', '').strip().lstrip('@').lower()
@@ -203,17 +198,11 @@ def check_screen_name(current_user_id):
         if not screen_name:
             return {'available': False, 'reason': 'Screen name cannot be empty'}, 400
         
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if current_user and current_user.screen_name == screen_name:
             return {'available': True, 'current': True}, 200
         
-        existing = User.query.filter(
-            User.screen_name == screen_name,
-            User.id != current_user_id,
-            User.is_active == True
-        ).first()
-        
-        if existing:
+        if user_exists(db.func.lower(User.screen_name) == screen_name, User.id != current_user_id):
             return {'available': False, 'reason': 'Screen name already taken'}, 200
         
         return {'available': True}, 200
@@ -223,18 +212,10 @@ def check_screen_name(current_user_id):
         return {'error': 'Failed to check screen name'}, 500
 
 @profile_bp.route('/users/search', methods=['GET'])
+@limiter.limit("30 per minute", override_defaults=False, error_message='30 searches per minute allowed')
 @token_required
 def search_users(current_user_id):
     """Search users - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 searches per minute allowed'}, 429
-    
     try:
         query = request.args.get('q', '').strip()
         
@@ -242,28 +223,39 @@ def search_users(current_user_id):
             return {'users': []}, 200
         
         clean_query = query[1:].lower()
+        # '_' is legal in screen names; match it (and '%') literally
+        like_prefix = clean_query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
         
-        current_app.logger.info(f"🔍 User search for '@{clean_query}' by user {current_user_id}")
+        log_info = current_app.logger.isEnabledFor(logging.INFO)
+        if log_info:
+            current_app.logger.info(f"🔍 User search for '@{clean_query}' by user {current_user_id}")
         
-        users = User.query.filter(
-            db.and_(
+        rows = db.session.execute(
+            db.select(User.id, User.screen_name, User.profile_image_url, User.is_verified)
+            .where(
                 User.id != current_user_id,
-                User.screen_name.ilike(f'{clean_query}%')
+                User.is_active == True,
+                db.func.lower(User.screen_name).like(f'{like_prefix}%', escape='\\')
             )
-        ).limit(10).all()
-        
-        user_results = []
-        for user in users:
-            if user.screen_name:
-                user_results.append({
-                    'id': user.id,
-                    'screen_name': user.screen_name,
-                    'display_name': f"@{user.screen_name}",
-                    'profile_image_url': user.profile_image_url,
-                    'is_verified': user.is_verified or False
-                })
+            # text_pattern_ops orders bytewise, so only a C-collated sort can read it in index order
+            .order_by(db.func.lower(User.screen_name).collate('C'))
+            .limit(10)
+        ).all()
+        
+        user_results = [
+            {
+                'id': user_id,
+                'screen_name': screen_name,
+                'display_name': '@' + screen_name,
+                'profile_image_url': s3_service.profile_photo_url(user_id, profile_image_url),
+                'is_verified': bool(is_verified)
+            }
+            for user_id, screen_name, profile_image_url, is_verified in rows
+            if screen_name
+        ]
         
-        current_app.logger.info(f"🔍 User search returned {len(user_results)} results")
+        if log_info:
+            current_app.logger.info(f"🔍 User search returned {len(user_results)} results")
         
         return {'users': user_results}, 200
         
@@ -272,18 +264,10 @@ def search_users(current_user_id):
         return {'error': 'Search failed'}, 500
 
 @profile_bp.route('/users/lookup', methods=['POST'])
+@limiter.limit("30 per minute", override_defaults=False, error_message='30 lookups per minute allowed')
 @token_required
 def lookup_user(current_user_id):
     """Lookup user - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 lookups per minute allowed'}, 429
-    
     try:
         data = request.get_json()
         identifier = data.get('identifier', '').strip()
@@ -293,25 +277,19 @@ def lookup_user(current_user_id):
         
         current_app.logger.info(f"🔍 User lookup for '{identifier}' by user {current_user_id}")
         
-        user = None
+        lookup = db.select(
+            User.id, User.email, User.screen_name, User.profile_image_url, User.is_verified
+        ).where(User.id != current_user_id, User.is_active == True)
+        
+        # Probe a single indexed column instead of OR-ing email and screen name
         if identifier.startswith('@'):
-            clean_identifier = identifier[1:].lower()
-            user = User.query.filter(
-                db.and_(
-                    User.id != current_user_id,
-                    User.screen_name == clean_identifier
-                )
-            ).first()
+            lookup = lookup.where(db.func.lower(User.screen_name) == identifier[1:].lower())
+        elif '@' in identifier and '.' in identifier.rsplit('@', 1)[-1]:
+            lookup = lookup.where(db.func.lower(User.email) == identifier.lower())
         else:
-            user = User.query.filter(
-                db.and_(
-                    User.id != current_user_id,
-                    db.or_(
-                        User.email == identifier.lower(),
-                        User.screen_name == identifier.lower()
-                    )
-                )
-            ).first()
+            lookup = lookup.where(db.func.lower(User.screen_name) == identifier.lower())
+        
+        user = db.session.execute(lookup.limit(1)).first()
         
         if not user:
             current_app.logger.warning(f"🔍 User lookup failed: '{identifier}' not found")
@@ -323,7 +301,7 @@ def lookup_user(current_user_id):
                 'email': user.email,
                 'screen_name': user.screen_name,
                 'display_name': f"@{user.screen_name}" if user.screen_name else user.email,
-                'profile_image_url': user.profile_image_url,
+                'profile_image_url': s3_service.profile_photo_url(user.id, user.profile_image_url),
                 'is_verified': user.is_verified or False
             }
         }
@@ -337,18 +315,10 @@ def lookup_user(current_user_id):
         return {'error': 'Lookup failed'}, 500
 
 @profile_bp.route('/profile/delete', methods=['POST'])
+@limiter.limit("2 per day", override_defaults=False, error_message='Account deletion limited to 2 attempts per day')
 @token_required
 def delete_account(current_user_id):
     """Delete account - Very strict rate limiting"""
-    # Apply very strict rate limiting for account deletion
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("2 per day")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': 'Account deletion limited to 2 attempts per day'}, 429
-    
     try:
         data = request.get_json()
         password = data.get('password')
@@ -356,50 +326,58 @@ def delete_account(current_user_id):
         if not password:
             return {'error': 'Password is required to delete account'}, 400
         
-        user = User.query.get(current_user_id)
+        user = g.current_user
         if not user:
             return {'error': 'User not found'}, 404
         
-        if not bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
+        if not bcrypt.checkpw(password.encode('utf-8'), user.password_bytes):
             current_app.logger.warning(f"Failed delete attempt for user {current_user_id}: wrong password")
             return {'error': 'Invalid password'}, 401
         
         current_app.logger.info(f"⚠️ Account deletion initiated for user {current_user_id}")
         
         if current_app.config.get('USE_SOFT_DELETE', True):
-            user.is_active = False
-            user.deleted_at = datetime.now(timezone.utc)
-            user.deletion_reason = data.get('reason', 'User requested')
-            
-            user.email = f"deleted_{user.id}_{uuid.uuid4().hex[:8]}@deleted.local"
-            user.first_name = None
-            user.last_name = None
-            user.screen_name = f"deleted_user_{user.id}"
-            user.age = None
-            user.profile_image_url = None
-            
-            active_keys = ShareableKey.query.filter_by(
-                creator_id=current_user_id,
-                status='active'
-            ).all()
+            deleted_at = datetime.now(timezone.utc)
+            tombstone = uuid.uuid4().hex[:8]
             
-            for key in active_keys:
-                key.status = 'revoked'
-                key.revoked_reason = 'Account deleted'
-            
-            pending_requests = Request.query.filter(
-                db.and_(
-                    db.or_(
-                        Request.requester_id == current_user_id,
-                        Request.target_user_id == current_user_id
-                    ),
-                    Request.status == 'pending'
+            # Three statements in one savepoint, whatever the number of keys and requests.
+            # The names are blanked rather than nulled since the columns are NOT NULL.
+            with db.session.begin_nested():
+                db.session.execute(
+                    db.update(User)
+                    .where(User.id == current_user_id)
+                    .values(
+                        is_active=False,
+                        deleted_at=deleted_at,
+                        deletion_reason=data.get('reason', 'User requested'),
+                        email=f"deleted_{current_user_id}_{tombstone}@deleted.local",
+                        screen_name=f"deleted_user_{current_user_id}_{tombstone}",
+                        first_name='',
+                        last_name='',
+                        profile_image_url=None
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                
+                db.session.execute(
+                    db.update(ShareableKey)
+                    .where(ShareableKey.creator_id == current_user_id, ShareableKey.status == 'active')
+                    .values(status='revoked')
+                    .execution_options(synchronize_session=False)
+                )
+                
+                db.session.execute(
+                    db.update(Request)
+                    .where(
+                        db.or_(
+                            Request.requester_id == current_user_id,
+                            Request.target_user_id == current_user_id
+                        ),
+                        Request.status == 'pending'
+                    )
+                    .values(status='cancelled')
+                    .execution_options(synchronize_session=False)
                 )
-            ).all()
-            
-            for req in pending_requests:
-                req.status = 'cancelled'
-                req.cancellation_reason = 'Account deleted'
             
             db.session.commit()
             
@@ -407,24 +385,30 @@ def delete_account(current_user_id):
             
             return {
                 'message': 'Account has been deleted successfully',
-                'deleted_at': user.deleted_at.isoformat()
+                'deleted_at': deleted_at
             }, 200
         else:
-            KYCVerification.query.filter_by(user_id=current_user_id).delete()
+            db.session.execute(
+                db.delete(KYCVerification).where(KYCVerification.user_id == current_user_id)
+            )
             
-            ShareableKey.query.filter(
-                db.or_(
-                    ShareableKey.creator_id == current_user_id,
-                    ShareableKey.recipient_user_id == current_user_id
+            db.session.execute(
+                db.delete(ShareableKey).where(
+                    db.or_(
+                        ShareableKey.creator_id == current_user_id,
+                        ShareableKey.recipient_user_id == current_user_id
+                    )
                 )
-            ).delete()
+            )
             
-            Request.query.filter(
-                db.or_(
-                    Request.requester_id == current_user_id,
-                    Request.target_user_id == current_user_id
+            db.session.execute(
+                db.delete(Request).where(
+                    db.or_(
+                        Request.requester_id == current_user_id,
+                        Request.target_user_id == current_user_id
+                    )
                 )
-            ).delete()
+            )
             
             db.session.delete(user)
             db.session.commit()
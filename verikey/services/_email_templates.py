@@ -0,0 +1,12 @@
+import os
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+# Templates are compiled once per process and never re-checked on disk
+_ENV = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+    cache_size=-1
+)
+
+VERIFY_TMPL = _ENV.get_template('verify_request.html')
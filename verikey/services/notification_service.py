@@ -1,13 +1,44 @@
 import os
 import re
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Union
+from verikey.services._email_templates import VERIFY_TMPL
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive pooled connections so sends after the first skip the TLS handshake
+_SES_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={'max_attempts': 3, 'mode': 'standard'},
+    connect_timeout=3,
+    read_timeout=10
+)
+
+# boto3 is blocking; sends run here so they don't stall the event loop.
+# Kept below max_pool_connections so workers never wait on the HTTP pool.
+_SES_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix='ses')
+
+SES_TEMPLATE_NAME = 'verikey_verify_v1'
+SES_BULK_LIMIT = 50
+
+# Valid information types are a small fixed set; the bound keeps client-supplied
+# values from growing the cache without limit
+@lru_cache(maxsize=64)
+def _info_type_label(info_type: str) -> str:
+    return info_type.replace('_', ' ').title()
+
 class NotificationService:
+    # None until the SES template has been registered (True) or refused (False)
+    _template_ready = None
+
     def __init__(self):
         self.aws_region = os.getenv('AWS_REGION', 'us-east-2')
         try:
@@ -15,7 +46,8 @@ class NotificationService:
                 'ses',
                 region_name=self.aws_region,
                 aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                config=_SES_CONFIG
             )
         except Exception as e:
             logger.warning(f"Failed to initialize SES client: {e}")
@@ -25,27 +57,83 @@ class NotificationService:
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@verikey.app')
 
     def identify_recipient_type(self, recipient: str) -> str:
-        if '@' in recipient:
+        if recipient.find('@') > 0:
             return 'email'
         else:
             return 'unknown'
 
     async def send_verification_request(self, 
-                                      recipient: str, 
+                                      recipient: Union[str, List[str]], 
                                       requester_name: str,
                                       request_label: str,
                                       information_types: list,
                                       request_id: Optional[int] = None,
                                       shareable_url: Optional[str] = None) -> Dict[str, Any]:
         
-        if '@' in recipient:
+        recipients = [recipient] if isinstance(recipient, str) else list(recipient)
+        emails = [r for r in recipients if '@' in r]
+        
+        if len(emails) > 1:
+            return await self._send_ses_bulk_request(
+                emails, requester_name, request_label,
+                information_types, request_id, shareable_url
+            )
+        elif emails:
             return await self._send_ses_email_request(
-                recipient, requester_name, request_label, 
+                emails[0], requester_name, request_label, 
                 information_types, request_id, shareable_url
             )
         else:
             return {"status": "failed", "error": "Unsupported recipient type"}
 
+    def _ensure_template(self) -> bool:
+        """Register the verification email as an SES template once per process"""
+        if NotificationService._template_ready is not None:
+            return NotificationService._template_ready
+
+        html_part = VERIFY_TMPL.render(
+            ses=True,
+            request_label='{{request_label}}',
+            requester_name='{{requester_name}}',
+            action_url='{{action_url}}',
+            action_text='{{action_text}}'
+        )
+
+        try:
+            self.ses_client.create_template(Template={
+                'TemplateName': SES_TEMPLATE_NAME,
+                'SubjectPart': 'Verification Request: {{request_label}}',
+                'HtmlPart': html_part
+            })
+            NotificationService._template_ready = True
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == 'AlreadyExists':
+                NotificationService._template_ready = True
+            else:
+                logger.warning(f"SES template registration failed, sending full HTML instead: {error_code}")
+                NotificationService._template_ready = False
+
+        return NotificationService._template_ready
+
+    def _template_data(self, requester_name: str, request_label: str, information_types: list,
+                       request_id: Optional[int] = None,
+                       shareable_url: Optional[str] = None) -> Dict[str, Any]:
+        if shareable_url:
+            action_url = shareable_url
+            action_text = "Respond to Request"
+        else:
+            action_url = f"{self.app_base_url}/respond/{request_id}"
+            action_text = "Open VeriKey App"
+
+        return {
+            'request_label': request_label,
+            'requester_name': requester_name,
+            'information_types': [_info_type_label(info_type) for info_type in information_types],
+            'action_url': action_url,
+            'action_text': action_text
+        }
+
     async def _send_ses_email_request(self, email: str, requester_name: str, 
                                     request_label: str, information_types: list,
                                     request_id: Optional[int] = None,
@@ -55,81 +143,39 @@ class NotificationService:
             return {"status": "skipped", "reason": "ses_service_not_configured"}
 
         try:
-            if shareable_url:
-                action_url = shareable_url
-                action_text = "Respond to Request"
-            else:
-                action_url = f"{self.app_base_url}/respond/{request_id}"
-                action_text = "Open VeriKey App"
+            loop = asyncio.get_running_loop()
+            template_data = self._template_data(
+                requester_name, request_label, information_types, request_id, shareable_url
+            )
 
-            info_list = ", ".join(information_types)
-            
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>VeriKey Verification Request</title>
-            </head>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333; max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="background: #b5ead7; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                    <h1 style="margin: 0; color: #1f2937; font-size: 28px;">🔐 VeriKey Request</h1>
-                </div>
-                
-                <div style="background: white; padding: 40px; border: 1px solid #e5e7eb; border-radius: 0 0 10px 10px;">
-                    <h2 style="color: #1f2937; margin-bottom: 20px;">Verification Request: {request_label}</h2>
-                    
-                    <p style="font-size: 18px; color: #374151; margin-bottom: 25px;">
-                        <strong>{requester_name}</strong> has requested verification of your:
-                    </p>
-                    
-                    <div style="background: #f3f4f6; padding: 20px; border-radius: 8px; margin: 25px 0;">
-                        <ul style="margin: 0; padding-left: 25px; color: #1f2937;">
-                            {"".join(f"<li style='margin-bottom: 8px;'>{info_type.replace('_', ' ').title()}</li>" for info_type in information_types)}
-                        </ul>
-                    </div>
-                    
-                    <p style="color: #6b7280; margin-bottom: 30px;">
-                        This request is secure and your information will only be shared with {requester_name}.
-                    </p>
-                    
-                    <div style="text-align: center; margin: 40px 0;">
-                        <a href="{action_url}" 
-                           style="background: #FFD66B; color: #1f2937; padding: 16px 32px; 
-                                  text-decoration: none; border-radius: 25px; font-weight: bold;
-                                  display: inline-block; font-size: 18px;">
-                            {action_text}
-                        </a>
-                    </div>
-                    
-                    <div style="border-top: 1px solid #e5e7eb; padding-top: 25px; margin-top: 40px;">
-                        <p style="font-size: 14px; color: #9ca3af; text-align: center; margin: 0;">
-                            This request was sent through VeriKey, a secure identity verification platform.<br>
-                            If you did not expect this request, you can safely ignore this email.
-                        </p>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-
-            response = self.ses_client.send_email(
-                Source=self.from_email,
-                Destination={'ToAddresses': [email]},
-                Message={
-                    'Subject': {
-                        'Data': f'Verification Request: {request_label}',
-                        'Charset': 'UTF-8'
-                    },
-                    'Body': {
-                        'Html': {
-                            'Data': html_content,
+            # With the template registered only the substitution data goes over the wire
+            if await loop.run_in_executor(_SES_POOL, self._ensure_template):
+                send = lambda: self.ses_client.send_templated_email(
+                    Source=self.from_email,
+                    Destination={'ToAddresses': [email]},
+                    Template=SES_TEMPLATE_NAME,
+                    TemplateData=json.dumps(template_data)
+                )
+            else:
+                html_content = VERIFY_TMPL.render(**template_data)
+                send = lambda: self.ses_client.send_email(
+                    Source=self.from_email,
+                    Destination={'ToAddresses': [email]},
+                    Message={
+                        'Subject': {
+                            'Data': f'Verification Request: {request_label}',
                             'Charset': 'UTF-8'
+                        },
+                        'Body': {
+                            'Html': {
+                                'Data': html_content,
+                                'Charset': 'UTF-8'
+                            }
                         }
                     }
-                }
-            )
+                )
+
+            response = await loop.run_in_executor(_SES_POOL, send)
 
             logger.info(f"SES email sent successfully to {email}")
             
@@ -149,6 +195,64 @@ class NotificationService:
             logger.error(f"Unexpected error sending SES email to {email}: {str(e)}")
             return {"status": "failed", "method": "ses_email", "error": str(e)}
 
+    async def _send_ses_bulk_request(self, emails: List[str], requester_name: str,
+                                   request_label: str, information_types: list,
+                                   request_id: Optional[int] = None,
+                                   shareable_url: Optional[str] = None) -> Dict[str, Any]:
+        if not self.ses_client:
+            logger.warning("SES not configured, skipping email")
+            return {"status": "skipped", "reason": "ses_service_not_configured"}
+
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(_SES_POOL, self._ensure_template):
+            results = [
+                await self._send_ses_email_request(
+                    email, requester_name, request_label,
+                    information_types, request_id, shareable_url
+                )
+                for email in emails
+            ]
+        else:
+            default_data = json.dumps(self._template_data(
+                requester_name, request_label, information_types, request_id, shareable_url
+            ))
+            results = []
+            for start in range(0, len(emails), SES_BULK_LIMIT):
+                batch = emails[start:start + SES_BULK_LIMIT]
+                try:
+                    response = await loop.run_in_executor(
+                        _SES_POOL,
+                        lambda: self.ses_client.send_bulk_templated_email(
+                            Source=self.from_email,
+                            Template=SES_TEMPLATE_NAME,
+                            DefaultTemplateData=default_data,
+                            Destinations=[{'Destination': {'ToAddresses': [email]}} for email in batch]
+                        )
+                    )
+                    for email, status in zip(batch, response['Status']):
+                        results.append({
+                            "status": "sent" if status['Status'] == 'Success' else "failed",
+                            "recipient": email,
+                            "message_id": status.get('MessageId'),
+                            "error": status.get('Error')
+                        })
+                except ClientError as e:
+                    error_code = e.response['Error']['Code']
+                    logger.error(f"SES bulk send failed for {len(batch)} recipients: {error_code}")
+                    results.extend(
+                        {"status": "failed", "recipient": email, "error": f"SES error: {error_code}"}
+                        for email in batch
+                    )
+
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        logger.info(f"SES bulk send delivered {sent}/{len(emails)} emails")
+
+        return {
+            "status": "sent" if sent == len(emails) else ("partial" if sent else "failed"),
+            "method": "ses_bulk_email",
+            "results": results
+        }
+
     async def send_verification_response_notification(self, *args, **kwargs):
         return {"status": "not_implemented"}
     
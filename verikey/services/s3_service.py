@@ -1,19 +1,101 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import uuid
 import os
 import base64
 import io
-from datetime import datetime, timedelta
+import re
+import secrets
+import struct
+from datetime import datetime, timezone, timedelta
+from threading import Lock
+from cachetools import TLRUCache
 from flask import current_app
 from PIL import Image
 
+try:
+    # libvips (libjpeg-turbo, tiled processing) is used when installed
+    import pyvips
+except ImportError:
+    pyvips = None
+
+# One pooled, keep-alive client is shared by every request in the worker
+_S3_CONFIG = Config(
+    max_pool_connections=max(32, 2 * int(os.getenv('GUNICORN_THREADS', 1))),
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=10
+)
+
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Presigned GET URLs are reused until 60 s before they expire
+PRESIGN_MARGIN = 60
+_PRESIGN_CACHE = TLRUCache(maxsize=4096, ttu=lambda key, value, now: now + key[1] - PRESIGN_MARGIN)
+_PRESIGN_LOCK = Lock()
+
+# Uploads already within the target size are stored as-is
+PASSTHROUGH_MAX_BYTES = 400_000
+
+# Every object this service writes lives at the bucket root under one of these prefixes
+PHOTO_KEY_RE = re.compile(r'^(?:verification|profile|kyc)_[0-9A-Za-z_]+\.(?:jpg|webp)$')
+
+# Re-encoded photos are stored as WebP; PHOTO_FORMAT=jpg restores JPEG output
+PHOTO_FORMAT = os.getenv('PHOTO_FORMAT', 'webp')
+PHOTO_CONTENT_TYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp'}
+# Largest object a presigned upload may write, and finalize_upload will read
+DIRECT_UPLOAD_MAX_BYTES = 4_000_000
+
+# Presigned uploads land under this extension in any image format; finalize_upload
+# stores them under the extension of what it actually writes
+UPLOAD_EXT = 'upload'
+
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _jpeg_dims(buf):
+    """Read (width, height) from a JPEG's SOF header without decoding it.
+
+    Returns None for anything that isn't a plain JPEG, and for JPEGs carrying
+    an APP1 (EXIF or XMP) or APP13 (IPTC) block, either of which can hold GPS
+    data and must go through re-encoding to be stripped.
+    """
+    if buf[:2] != b'\xff\xd8':
+        return None
+    
+    i = 2
+    while i + 9 <= len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', buf[i + 5:i + 9])
+            return width, height
+        if marker in (0xE1, 0xED):
+            return None
+        if marker == 0xDA:
+            return None
+        i += 2 + struct.unpack('>H', buf[i + 2:i + 4])[0]
+    return None
+
 class S3Service:
     def __init__(self):
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
             aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
+            region_name=os.getenv('AWS_REGION'),
+            config=_S3_CONFIG
         )
         self.bucket_name = os.getenv('AWS_S3_BUCKET')
     
@@ -27,28 +109,32 @@ class S3Service:
             else:
                 image_bytes = image_data
             
-            image_bytes = self._optimize_image(image_bytes)
+            image_bytes, ext = self._optimize_image(image_bytes)
             
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            filename = f"verification_{request_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
+            now = datetime.now(timezone.utc)
+            now_iso = now.isoformat()
+            filename = f"verification_{request_id}_{now.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}.{ext}"
             
-            expires_at = datetime.utcnow() + timedelta(hours=expiry_hours)
+            expires_at = now + timedelta(hours=expiry_hours)
             
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=filename,
-                Body=image_bytes,
-                ContentType='image/jpeg',
-                Metadata={
-                    'request_id': str(request_id),
-                    'expires_hours': str(expiry_hours),
-                    'expires_at': expires_at.isoformat(),
-                    'uploaded_at': datetime.utcnow().isoformat(),
-                    'purpose': 'verification_photo'
-                }
+            self.s3_client.upload_fileobj(
+                io.BytesIO(image_bytes),
+                self.bucket_name,
+                filename,
+                ExtraArgs={
+                    'ContentType': PHOTO_CONTENT_TYPES[ext],
+                    'Metadata': {
+                        'request_id': str(request_id),
+                        'expires_hours': str(expiry_hours),
+                        'expires_at': expires_at.isoformat(),
+                        'uploaded_at': now_iso,
+                        'purpose': 'verification_photo'
+                    }
+                },
+                Config=_TRANSFER_CONFIG
             )
             
-            photo_url = f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{filename}"
+            photo_url = self.object_url(filename)
             
             current_app.logger.info(f"✅ Photo uploaded successfully: {filename}")
             return photo_url
@@ -57,7 +143,130 @@ class S3Service:
             current_app.logger.error(f"❌ S3 upload failed: {str(e)}")
             return None
     
-    def _optimize_image(self, image_bytes, max_size=(800, 800), quality=85):
+    def upload_profile_photo(self, image_data, user_id):
+        try:
+            if isinstance(image_data, str):
+                if image_data.startswith('data:image'):
+                    image_data = image_data.split(',')[1]
+                
+                image_bytes = base64.b64decode(image_data)
+            else:
+                image_bytes = image_data
+            
+            image_bytes, ext = self._optimize_image(image_bytes, max_size=(400, 400))
+            
+            filename = f"profile_{user_id}_{uuid.uuid4().hex[:8]}.{ext}"
+            
+            self.s3_client.upload_fileobj(
+                io.BytesIO(image_bytes),
+                self.bucket_name,
+                filename,
+                ExtraArgs={
+                    'ContentType': PHOTO_CONTENT_TYPES[ext],
+                    'Metadata': {
+                        'user_id': str(user_id),
+                        'purpose': 'profile_photo'
+                    }
+                },
+                Config=_TRANSFER_CONFIG
+            )
+            
+            current_app.logger.info(f"✅ Profile photo uploaded successfully: {filename}")
+            return filename
+            
+        except Exception as e:
+            current_app.logger.error(f"❌ S3 profile photo upload failed: {str(e)}")
+            return None
+    
+    def presign_post(self, key, expires=600, max_bytes=DIRECT_UPLOAD_MAX_BYTES):
+        """Presigned POST for one object; unlike a PUT URL its policy caps the size"""
+        try:
+            return self.s3_client.generate_presigned_post(
+                self.bucket_name,
+                key,
+                Conditions=[
+                    ['content-length-range', 0, max_bytes],
+                    ['starts-with', '$Content-Type', 'image/']
+                ],
+                ExpiresIn=expires
+            )
+        except Exception as e:
+            current_app.logger.error(f"❌ Presigned POST generation failed: {str(e)}")
+            return None
+    
+    def presign_upload(self, request_id, expires=600, max_bytes=DIRECT_UPLOAD_MAX_BYTES):
+        key = f"verification_{request_id}_{uuid.uuid4().hex}.{UPLOAD_EXT}"
+        post = self.presign_post(key, expires, max_bytes)
+        return (post, key) if post else (None, None)
+    
+    def object_url(self, key):
+        return f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{key}"
+    
+    def finalize_upload(self, key):
+        """Re-encode a photo the client uploaded directly, as server-side uploads are.
+
+        Strips EXIF/XMP (including GPS) and resizes, then stores the result under
+        the extension and content type of the format written. Returns the stored
+        key, or None if nothing usable was uploaded.
+        """
+        stem, _, upload_ext = key.rpartition('.')
+        if upload_ext != UPLOAD_EXT:
+            return None
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError:
+            # A retried submit: the upload was already moved to its stored key
+            for ext in PHOTO_CONTENT_TYPES:
+                try:
+                    self.s3_client.head_object(Bucket=self.bucket_name, Key=f"{stem}.{ext}")
+                    return f"{stem}.{ext}"
+                except ClientError:
+                    continue
+            return None
+        if head['ContentLength'] > DIRECT_UPLOAD_MAX_BYTES:
+            current_app.logger.warning(f"Rejecting oversized upload {key}: {head['ContentLength']} bytes")
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            return None
+        
+        body = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)['Body'].read()
+        image_bytes, ext = self._optimize_image(body)
+        if image_bytes is body and _jpeg_dims(body) is None:
+            # Neither a plain JPEG passed through nor anything the encoders could read
+            current_app.logger.warning(f"Rejecting undecodable upload {key}")
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            return None
+        
+        stored_key = f"{stem}.{ext}"
+        self.s3_client.upload_fileobj(
+            io.BytesIO(image_bytes),
+            self.bucket_name,
+            stored_key,
+            ExtraArgs={'ContentType': PHOTO_CONTENT_TYPES[ext]},
+            Config=_TRANSFER_CONFIG
+        )
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+        return stored_key
+    
+    def _optimize_image(self, image_bytes, max_size=(800, 800), quality=None):
+        """Shrink an upload to fit max_size and return (bytes, file extension)"""
+        if len(image_bytes) < PASSTHROUGH_MAX_BYTES:
+            dims = _jpeg_dims(image_bytes)
+            if dims and dims[0] <= max_size[0] and dims[1] <= max_size[1]:
+                return image_bytes, 'jpg'
+        
+        webp = PHOTO_FORMAT == 'webp'
+        if quality is None:
+            quality = 80 if webp else 85
+        
+        if pyvips is not None:
+            try:
+                img = pyvips.Image.thumbnail_buffer(image_bytes, max_size[0], height=max_size[1], size='down')
+                if webp:
+                    return img.webpsave_buffer(Q=quality, effort=4, strip=True), 'webp'
+                return img.jpegsave_buffer(Q=quality, strip=True, optimize_coding=True, interlace=False), 'jpg'
+            except pyvips.Error as e:
+                current_app.logger.warning(f"libvips optimization failed: {str(e)}, falling back to Pillow")
+        
         try:
             img = Image.open(io.BytesIO(image_bytes))
             
@@ -67,17 +276,23 @@ class S3Service:
             img.thumbnail(max_size, Image.Resampling.LANCZOS)
             
             output = io.BytesIO()
-            img.save(output, format='JPEG', quality=quality, optimize=True)
+            if webp:
+                img.save(output, format='WEBP', quality=quality, method=4)
+            else:
+                img.save(output, format='JPEG', quality=quality, optimize=True)
             
-            return output.getvalue()
+            return output.getvalue(), 'webp' if webp else 'jpg'
             
         except Exception as e:
             current_app.logger.warning(f"Image optimization failed: {str(e)}, using original")
-            return image_bytes
+            return image_bytes, 'jpg'
     
     def delete_photo(self, photo_url):
         try:
-            filename = photo_url.split('/')[-1]
+            filename = photo_url.rpartition('/')[2]
+            if not PHOTO_KEY_RE.match(filename):
+                current_app.logger.warning(f"Refusing to delete unexpected S3 key: {filename}")
+                return False
             
             self.s3_client.delete_object(
                 Bucket=self.bucket_name,
@@ -91,9 +306,28 @@ class S3Service:
             current_app.logger.error(f"❌ S3 delete failed: {str(e)}")
             return False
     
+    def profile_photo_url(self, user_id, stored, expiration=3600):
+        """URL a client can load for users.profile_image_url.
+
+        Photos uploaded here are stored as the bare S3 key and signed on read;
+        external URLs and older inline values are returned as they are.
+        """
+        if stored and stored.startswith(f"profile_{user_id}_") and PHOTO_KEY_RE.match(stored):
+            return self.get_presigned_url(stored, expiration)
+        return stored
+    
     def get_presigned_url(self, photo_url, expiration=3600):
         try:
-            filename = photo_url.split('/')[-1]
+            filename = photo_url.rpartition('/')[2]
+            if not PHOTO_KEY_RE.match(filename):
+                current_app.logger.warning(f"Refusing to presign unexpected S3 key: {filename}")
+                return None
+            cache_key = (filename, expiration)
+            
+            with _PRESIGN_LOCK:
+                presigned_url = _PRESIGN_CACHE.get(cache_key)
+            if presigned_url:
+                return presigned_url
             
             presigned_url = self.s3_client.generate_presigned_url(
                 'get_object',
@@ -101,6 +335,10 @@ class S3Service:
                 ExpiresIn=expiration
             )
             
+            if expiration > PRESIGN_MARGIN:
+                with _PRESIGN_LOCK:
+                    _PRESIGN_CACHE[cache_key] = presigned_url
+            
             return presigned_url
             
         except Exception as e:
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from rq import Queue, Retry
+from verikey.cache import get_redis
+from verikey.services.notification_service import notification_service
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_NAME = 'emails'
+EMAIL_RETRY_INTERVALS = [10, 60, 300]
+
+_email_queue = None
+
+# In-process fallback jobs block on SES calls that run on notification_service's
+# own pool, so they must not occupy that pool's workers themselves
+_FALLBACK_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='email-fallback')
+
+def send_verification_email(request_id, recipient, requester_name, request_label, information_types):
+    """Job body: deliver one verification request email through SES"""
+    result = asyncio.run(notification_service.send_verification_request(
+        recipient, requester_name, request_label, information_types, request_id=request_id
+    ))
+    if result.get('status') == 'failed':
+        # Raising lets RQ schedule the next retry
+        raise RuntimeError(f"Verification email for request {request_id} failed: {result.get('error')}")
+    return result
+
+def _get_email_queue():
+    global _email_queue
+    if _email_queue is None:
+        client = get_redis()
+        if client is not None:
+            _email_queue = Queue(EMAIL_QUEUE_NAME, connection=client)
+    return _email_queue
+
+def enqueue_verification_email(request_id, recipient, requester_name, request_label, information_types):
+    """Send the verification email off the request path.
+
+    Jobs go to the RQ 'emails' queue (run `rq worker emails`) when Redis is
+    configured; otherwise they run on a small fallback thread pool in this process.
+    """
+    args = (request_id, recipient, requester_name, request_label, list(information_types))
+    queue = _get_email_queue()
+    if queue is not None:
+        try:
+            queue.enqueue(
+                send_verification_email, *args,
+                result_ttl=0,
+                retry=Retry(max=len(EMAIL_RETRY_INTERVALS), interval=EMAIL_RETRY_INTERVALS)
+            )
+            return
+        except Exception as e:
+            logger.warning(f"Email queue unavailable, sending in-process: {str(e)}")
+    _FALLBACK_POOL.submit(_send_in_process, *args)
+
+def _send_in_process(*args):
+    try:
+        send_verification_email(*args)
+    except Exception as e:
+        logger.error(str(e))
@@ -1,133 +1,179 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from werkzeug.exceptions import BadRequest
+from sqlalchemy.orm import joinedload
 import re
-import uuid
+from verikey.extensions import limiter
 from verikey.models import db
 from verikey.models import User, Request, ShareableKey
 from verikey.decorators import token_required
-from datetime import datetime
-import json
+from datetime import datetime, timezone
+from verikey.ids import new_ulid
+from verikey.services.s3_service import s3_service
+from verikey.tasks import enqueue_verification_email
+import orjson
 
 verification_bp = Blueprint('verification', __name__)
 
+PHOTO_UPLOAD_EXPIRY = 600
+REQUESTS_PAGE_SIZE = 50
+REQUESTS_MAX_PAGE_SIZE = 200
+PHOTO_UPLOAD_SLOTS = ('selfie', 'photo')
+
+TITLE_MIN_LENGTH = 3
+TITLE_MAX_LENGTH = 30
+MAX_WORD_LENGTH = 15
+_WHITESPACE_RE = re.compile(r'\s')
+_LONG_WORD_RE = re.compile(r'\S{%d,}' % (MAX_WORD_LENGTH + 1))
+_LETTER_RE = re.compile(r'[^\W\d_]')
+
 def validate_title(title: str) -> tuple[bool, str]:
-    if not title or not title.strip():
+    title = title.strip() if title else ''
+    if not title:
         return False, "Title is required"
     
-    title = title.strip()
+    length = len(title)
     
-    MIN_LENGTH = 3
-    MAX_LENGTH = 30
+    if length < TITLE_MIN_LENGTH:
+        return False, f"Title must be at least {TITLE_MIN_LENGTH} characters"
     
-    if len(title) < MIN_LENGTH:
-        return False, f"Title must be at least {MIN_LENGTH} characters"
+    if length > TITLE_MAX_LENGTH:
+        return False, f"Title must be no more than {TITLE_MAX_LENGTH} characters"
     
-    if len(title) > MAX_LENGTH:
-        return False, f"Title must be no more than {MAX_LENGTH} characters"
-    
-    words = title.split()
-    if len(words) == 1 and len(title) > 20:
+    if length > 20 and not _WHITESPACE_RE.search(title):
         return False, "Title appears to be a single long word. Please use a descriptive title"
     
-    MAX_WORD_LENGTH = 15
-    for word in words:
-        if len(word) > MAX_WORD_LENGTH:
-            return False, f"Individual words in title cannot exceed {MAX_WORD_LENGTH} characters"
+    if _LONG_WORD_RE.search(title):
+        return False, f"Individual words in title cannot exceed {MAX_WORD_LENGTH} characters"
     
-    if not any(c.isalpha() for c in title):
+    if not _LETTER_RE.search(title):
         return False, "Title must contain at least some letters"
     
     return True, ""
 
+# Counterpart columns the request list renders; the rest of each user row stays on the server
+LIST_USER_COLUMNS = (User.id, User.screen_name, User.first_name, User.last_name, User.email)
+
+def request_user_label(user, names):
+    """@screen_name, else full name, for a request counterpart; memoized in names by user id"""
+    if user is None:
+        return None
+    label = names.get(user.id)
+    if label is None:
+        if user.screen_name:
+            label = f"@{user.screen_name}"
+        elif user.first_name:
+            label = f"{user.first_name} {user.last_name or ''}".strip()
+        else:
+            label = ''
+        names[user.id] = label
+    return label
+
+def sent_target_name(req, names):
+    """Display name for the recipient of a sent request"""
+    target_name = request_user_label(req.target_user, names)
+    if target_name:
+        return target_name
+    if not req.target_email:
+        return 'Unknown'
+    if req.target_email.startswith('shareable-'):
+        return 'Shareable Link'
+    return req.target_email
+
+def request_page(query, cursor, limit):
+    """One newest-first page of query, keyset-paginated on (created_at, id).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        created_at, _, last_id = cursor.rpartition('_')
+        # fromisoformat only accepts a trailing Z from Python 3.11
+        if created_at.endswith('Z'):
+            created_at = created_at[:-1] + '+00:00'
+        query = query.filter(
+            db.tuple_(Request.created_at, Request.id) < (datetime.fromisoformat(created_at), int(last_id))
+        )
+    rows = query.order_by(Request.created_at.desc(), Request.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    # UTC with a Z suffix keeps the cursor free of '+', which query strings decode as a space
+    last_created = rows[-1].created_at.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+    return rows, f"{last_created}_{rows[-1].id}"
+
 @verification_bp.route('/requests', methods=['GET'])
+@limiter.limit("60 per minute", override_defaults=False, error_message='60 requests per minute allowed')
 @token_required
 def get_requests(current_user_id):
     """Get all requests - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("60 per minute")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '60 requests per minute allowed'}, 429
-    
     try:
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if not current_user:
             return {'error': 'User not found'}, 404
         
-        sent_requests = Request.query.filter_by(
-            requester_id=current_user_id
-        ).order_by(Request.created_at.desc()).all()
-        
-        received_requests = Request.query.filter_by(
-            target_email=current_user.email
-        ).order_by(Request.created_at.desc()).all()
-        
-        sent_requests_ui = []
-        for req in sent_requests:
-            if req.status == 'completed':
-                continue
-            
-            target_user = User.query.get(req.target_user_id) if req.target_user_id else None
-            
-            if target_user and target_user.screen_name:
-                target_name = f"@{target_user.screen_name}"
-            elif target_user and target_user.first_name:
-                target_name = f"{target_user.first_name} {target_user.last_name or ''}".strip()
-            elif req.target_email and not req.target_email.startswith('shareable-'):
-                target_name = req.target_email
-            elif req.target_email and req.target_email.startswith('shareable-'):
-                target_name = 'Shareable Link'
-            else:
-                target_name = 'Unknown'
-            
-            sent_requests_ui.append({
-                'id': req.id,
-                'title': req.label,
-                'status': req.status,
-                'sentTo': target_name,
-                'sentOn': req.created_at.isoformat() if req.created_at else 'Unknown',
-                'informationTypes': req.get_information_types(),
-                'notes': req.notes or '',
-                'type': 'sent'
-            })
-        
-        received_requests_ui = []
-        for req in received_requests:
-            if req.status == 'completed':
-                continue
-            
-            requester = User.query.get(req.requester_id)
-            
-            if requester and requester.screen_name:
-                requester_name = f"@{requester.screen_name}"
-            elif requester and requester.first_name:
-                requester_name = f"{requester.first_name} {requester.last_name or ''}".strip()
-            elif requester:
-                requester_name = requester.email
-            else:
-                requester_name = 'Unknown'
-            
-            received_requests_ui.append({
-                'id': req.id,
-                'title': req.label,
-                'status': req.status,
-                'from': requester_name,
-                'receivedOn': req.created_at.isoformat() if req.created_at else 'Unknown',
-                'informationTypes': req.get_information_types(),
-                'notes': req.notes or '',
-                'type': 'received'
-            })
+        try:
+            limit = min(max(int(request.args.get('limit', REQUESTS_PAGE_SIZE)), 1), REQUESTS_MAX_PAGE_SIZE)
+            # Counterparts come back in the same query instead of one get() per row
+            sent_requests, next_sent_cursor = request_page(
+                Request.query.options(
+                    joinedload(Request.target_user).load_only(*LIST_USER_COLUMNS)
+                ).filter(
+                    Request.requester_id == current_user_id,
+                    Request.status != 'completed'
+                ),
+                request.args.get('sent_cursor'),
+                limit
+            )
+            received_requests, next_received_cursor = request_page(
+                Request.query.options(
+                    joinedload(Request.requester).load_only(*LIST_USER_COLUMNS)
+                ).filter(
+                    Request.target_email == current_user.email,
+                    Request.status != 'completed'
+                ),
+                request.args.get('received_cursor'),
+                limit
+            )
+        except ValueError:
+            return {'error': 'Invalid limit or cursor'}, 400
+        
+        # Each counterpart's label is built once, however many rows point at them
+        names = {}
+        
+        sent_requests_ui = [{
+            'id': req.id,
+            'title': req.label,
+            'status': req.status,
+            'sentTo': sent_target_name(req, names),
+            'sentOn': req.created_at or 'Unknown',
+            'informationTypes': req.information_types or [],
+            'notes': req.notes or '',
+            'type': 'sent'
+        } for req in sent_requests]
+        
+        received_requests_ui = [{
+            'id': req.id,
+            'title': req.label,
+            'status': req.status,
+            'from': request_user_label(req.requester, names) or (req.requester.email if req.requester else 'Unknown'),
+            'receivedOn': req.created_at or 'Unknown',
+            'informationTypes': req.information_types or [],
+            'notes': req.notes or '',
+            'type': 'received'
+        } for req in received_requests]
         
         current_app.logger.info(f"✅ Retrieved {len(received_requests_ui)} received and {len(sent_requests_ui)} sent requests for user {current_user_id}")
         
+        # Each list appears under two keys; encode it once and splice the bytes into both
+        received_json = orjson.Fragment(orjson.dumps(received_requests_ui))
+        sent_json = orjson.Fragment(orjson.dumps(sent_requests_ui))
+        
         return {
-            'received': received_requests_ui,
-            'sent': sent_requests_ui,
-            'received_requests': received_requests_ui,
-            'sent_requests': sent_requests_ui
+            'received': received_json,
+            'sent': sent_json,
+            'received_requests': received_json,
+            'sent_requests': sent_json,
+            'next_received_cursor': next_received_cursor,
+            'next_sent_cursor': next_sent_cursor
         }, 200
         
     except Exception as e:
@@ -135,18 +181,10 @@ def get_requests(current_user_id):
         return {'error': 'Failed to get requests'}, 500
 
 @verification_bp.route('/requests', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 requests per hour allowed')
 @token_required
 def create_request(current_user_id):
     """Create request - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 requests per hour allowed'}, 429
-    
     try:
         data = request.get_json()
         current_app.logger.info(f"🚀 Creating request with data: {data}")
@@ -169,41 +207,55 @@ def create_request(current_user_id):
         target_user = None
         target_identifier = data['target_email'].strip()
         
-        target_user = User.query.filter_by(email=target_identifier).first()
-        if not target_user:
+        # Screen names can't contain '@', so only one of the two lookups can match
+        if target_identifier.find('@') > 0:
+            target_identifier = target_identifier.casefold()
+            target_user = User.query.filter_by(email=target_identifier).first()
+        else:
             clean_identifier = target_identifier.lstrip('@').lower()
             target_user = User.query.filter_by(screen_name=clean_identifier).first()
         
-        new_request = Request(
-            label=cleaned_title,
-            requester_id=current_user_id,
-            target_email=target_user.email if target_user else target_identifier,
-            target_user_id=target_user.id if target_user else None,
-            notes=data.get('notes', ''),
-            status='pending'
-        )
-        
-        if isinstance(data['information_types'], list):
-            new_request.set_information_types(data['information_types'])
-        else:
+        if not isinstance(data['information_types'], list):
             return {'error': 'Information types must be a list'}, 400
         
-        db.session.add(new_request)
+        target_email = target_user.email if target_user else target_identifier
+        target_user_id = target_user.id if target_user else None
+        
+        created = db.session.execute(
+            db.insert(Request)
+            .values(
+                label=cleaned_title,
+                requester_id=current_user_id,
+                target_email=target_email,
+                target_user_id=target_user_id,
+                notes=data.get('notes', ''),
+                status='pending',
+                information_types=data['information_types']
+            )
+            .returning(Request.id, Request.created_at)
+        ).one()
+        
         db.session.commit()
         
-        current_app.logger.info(f"✅ Created verification request: {new_request.id} from user {current_user_id} to {new_request.target_email}")
-        current_app.logger.info(f"🎯 Target user ID: {new_request.target_user_id}")
+        if current_app.config.get('VERIFICATION_EMAILS_ENABLED') and target_email.find('@') > 0:
+            enqueue_verification_email(
+                created.id, target_email, g.current_user.display_full_name,
+                cleaned_title, data['information_types']
+            )
+        
+        current_app.logger.info(f"✅ Created verification request: {created.id} from user {current_user_id} to {target_email}")
+        current_app.logger.info(f"🎯 Target user ID: {target_user_id}")
         
         return {
             'message': 'Verification request created successfully',
-            'request_id': new_request.id,
+            'request_id': created.id,
             'request': {
-                'id': new_request.id,
-                'label': new_request.label,
-                'target_email': new_request.target_email,
-                'target_user_id': new_request.target_user_id,
-                'status': new_request.status,
-                'created_at': new_request.created_at.isoformat()
+                'id': created.id,
+                'label': cleaned_title,
+                'target_email': target_email,
+                'target_user_id': target_user_id,
+                'status': 'pending',
+                'created_at': created.created_at
             }
         }, 201
         
@@ -213,25 +265,17 @@ def create_request(current_user_id):
         return {'error': 'Failed to create request'}, 500
 
 @verification_bp.route('/requests/<int:request_id>', methods=['DELETE'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def delete_request(current_user_id, request_id):
     """Delete request - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
-        verification_request = Request.query.get(request_id)
+        verification_request = db.session.get(Request, request_id)
         
         if not verification_request:
             return {'error': 'Request not found'}, 404
         
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if not current_user:
             return {'error': 'User not found'}, 404
         
@@ -243,13 +287,20 @@ def delete_request(current_user_id, request_id):
         
         if is_requester:
             if verification_request.status == 'completed':
-                existing_key = ShareableKey.query.filter_by(
-                    creator_id=verification_request.target_user_id,
-                    recipient_user_id=verification_request.requester_id,
-                    notes=db.func.concat('Verification response for request: ', verification_request.label)
-                ).first()
+                has_key = db.session.execute(db.select(db.exists().where(
+                    db.or_(
+                        ShareableKey.source_request_id == verification_request.id,
+                        # Keys created before source_request_id existed are matched by their note
+                        db.and_(
+                            ShareableKey.source_request_id.is_(None),
+                            ShareableKey.creator_id == verification_request.target_user_id,
+                            ShareableKey.recipient_user_id == verification_request.requester_id,
+                            ShareableKey.notes == f"Verification response for request: {verification_request.label}"
+                        )
+                    )
+                ))).scalar()
                 
-                if existing_key:
+                if has_key:
                     return {'error': 'This completed request has been turned into a key. Check your received keys.'}, 400
             
             if verification_request.status not in ['pending', 'denied', 'cancelled', 'completed']:
@@ -270,34 +321,35 @@ def delete_request(current_user_id, request_id):
         return {'error': 'Failed to delete request'}, 500
 
 @verification_bp.route('/requests/<int:request_id>/deny', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def deny_request(current_user_id, request_id):
     """Deny request - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
-        verification_request = Request.query.get(request_id)
-        
-        if not verification_request:
-            return {'error': 'Request not found'}, 404
-        
-        current_user = User.query.get(current_user_id)
-        if not current_user or current_user.email != verification_request.target_email:
-            return {'error': 'You can only deny requests sent to you'}, 403
-        
-        if verification_request.status != 'pending':
+        current_user = g.current_user
+        
+        # Ownership and status are checked by the UPDATE itself, so concurrent
+        # deny/submit calls can't both win
+        denied = db.session.execute(
+            db.update(Request)
+            .where(
+                Request.id == request_id,
+                Request.target_email == current_user.email,
+                Request.status == 'pending'
+            )
+            .values(status='denied', response_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        
+        if not denied:
+            db.session.rollback()
+            verification_request = db.session.get(Request, request_id)
+            if not verification_request:
+                return {'error': 'Request not found'}, 404
+            if current_user.email != verification_request.target_email:
+                return {'error': 'You can only deny requests sent to you'}, 403
             return {'error': f'Cannot deny a {verification_request.status} request'}, 400
         
-        verification_request.status = 'denied'
-        verification_request.response_at = datetime.utcnow()
-        
         db.session.commit()
         
         current_app.logger.info(f"✅ Request denied: ID {request_id} by user {current_user_id}")
@@ -312,46 +364,54 @@ def deny_request(current_user_id, request_id):
         return {'error': 'Failed to deny request'}, 500
 
 @verification_bp.route('/requests/<int:request_id>', methods=['PUT'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 operations per hour allowed')
 @token_required
 def update_request(current_user_id, request_id):
     """Update request - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 operations per hour allowed'}, 429
-    
     try:
         data = request.get_json()
-        verification_request = Request.query.get(request_id)
-        
-        if not verification_request:
-            return {'error': 'Request not found'}, 404
-        
-        if verification_request.requester_id != current_user_id:
-            return {'error': 'You can only update your own requests'}, 403
-        
-        if verification_request.status != 'pending':
-            return {'error': f'Cannot update a {verification_request.status} request'}, 400
+        values = {}
         
         if 'label' in data:
             is_valid, error_message = validate_title(data.get('label', ''))
             if not is_valid:
                 return {'error': error_message}, 400
-            verification_request.label = data['label'].strip()
+            values['label'] = data['label'].strip()
         
         if 'notes' in data:
-            verification_request.notes = data['notes']
+            values['notes'] = data['notes']
         
         if 'information_types' in data:
             if isinstance(data['information_types'], list):
-                verification_request.set_information_types(data['information_types'])
+                values['information_types'] = data['information_types']
             else:
                 return {'error': 'Information types must be a list'}, 400
         
+        # Only the requester's own pending requests match the UPDATE
+        ownership = (
+            Request.id == request_id,
+            Request.requester_id == current_user_id,
+            Request.status == 'pending'
+        )
+        if values:
+            matched = db.session.execute(
+                db.update(Request)
+                .where(*ownership)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        else:
+            matched = db.session.execute(db.select(db.exists().where(*ownership))).scalar()
+        
+        if not matched:
+            db.session.rollback()
+            verification_request = db.session.get(Request, request_id)
+            if not verification_request:
+                return {'error': 'Request not found'}, 404
+            if verification_request.requester_id != current_user_id:
+                return {'error': 'You can only update your own requests'}, 403
+            return {'error': f'Cannot update a {verification_request.status} request'}, 400
+        
         db.session.commit()
         
         current_app.logger.info(f"✅ Request updated: ID {request_id} by user {current_user_id}")
@@ -365,19 +425,142 @@ def update_request(current_user_id, request_id):
         current_app.logger.error(f"Failed to update request {request_id} for user {current_user_id}: {str(e)}")
         return {'error': 'Failed to update request'}, 500
 
+def uploaded_photo_key(request_id, key):
+    """S3 key of a photo the client uploaded directly for this request, if any"""
+    if not key or not key.startswith(f"verification_{request_id}_"):
+        return None
+    return s3_service.finalize_upload(key)
+
+# Builders for each requested information type in a verification response.
+# All take (current_user, data, additional_data, request_id, captured_at).
+
+def _response_fullname(current_user, data, additional_data, request_id, captured_at):
+    # Check additional_data first, then fall back to user profile
+    if 'fullname' in additional_data:
+        return additional_data['fullname']
+    if current_user.first_name and current_user.last_name:
+        return f"{current_user.first_name} {current_user.last_name}"
+    return "Name not available"
+
+def _response_firstname(current_user, data, additional_data, request_id, captured_at):
+    if 'firstname' in additional_data:
+        return additional_data['firstname']
+    return current_user.first_name or "First name not available"
+
+def _response_age(current_user, data, additional_data, request_id, captured_at):
+    if 'age' in additional_data:
+        return str(additional_data['age'])
+    return str(current_user.age) if current_user.age else "Age not provided"
+
+def _response_location(current_user, data, additional_data, request_id, captured_at):
+    if 'latitude' in data and 'longitude' in data:
+        return {
+            'latitude': data['latitude'],
+            'longitude': data['longitude'],
+            'cityDisplay': data.get('location_city_display', 'Location captured')
+        }
+    if 'location_data' in data:
+        return data['location_data']
+    return {
+        'cityDisplay': 'Location not captured',
+        'latitude': None,
+        'longitude': None
+    }
+
+def _response_image(slot):
+    """Builder for a selfie/photo slot: a direct S3 upload wins over inline base64.
+
+    Only the S3 key is stored; get_key_details signs a short-lived URL for it
+    while the shareable key can still be viewed.
+    """
+    def build(current_user, data, additional_data, request_id, captured_at):
+        image_key = uploaded_photo_key(request_id, data.get(f'{slot}_key'))
+        if not image_key and data.get(f'{slot}_base64'):
+            # Inline images are moved to S3 so the key row only holds the object key
+            image_url = s3_service.upload_verification_photo(data[f'{slot}_base64'], request_id)
+            image_key = image_url.rpartition('/')[2] if image_url else None
+        if image_key:
+            return {
+                'status': 'captured',
+                'image_key': image_key,
+                'image_data': None,
+                'captured_at': captured_at
+            }
+        if f'{slot}_base64' in data:
+            # S3 unavailable: keep the image inline rather than lose it
+            return {
+                'status': 'captured',
+                'image_data': data[f'{slot}_base64'],
+                'captured_at': captured_at
+            }
+        return {
+            'status': 'not_captured',
+            'image_data': None,
+            'captured_at': None
+        }
+    return build
+
+RESPONSE_FIELDS = {
+    'fullname': _response_fullname,
+    'firstname': _response_firstname,
+    'age': _response_age,
+    'location': _response_location,
+    'selfie': _response_image('selfie'),
+    'photo': _response_image('photo'),
+}
+
+@verification_bp.route('/verifications/presign', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 photo uploads per hour allowed')
+@token_required
+def presign_verification_photos(current_user_id):
+    """Get presigned S3 uploads for verification photos - Rate limited"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('request_id'):
+            return {'error': 'Request ID is required'}, 400
+        
+        request_id = data['request_id']
+        # Read-only check: fetch just the columns it needs rather than the whole row
+        verification_request = db.session.execute(
+            db.select(Request.target_email, Request.status, Request.information_types)
+            .where(Request.id == request_id)
+        ).first()
+        
+        if not verification_request:
+            return {'error': 'Request not found'}, 404
+        
+        current_user = g.current_user
+        if not current_user or current_user.email != verification_request.target_email:
+            return {'error': 'You can only respond to requests sent to you'}, 403
+        
+        if verification_request.status != 'pending':
+            return {'error': f'Cannot respond to a {verification_request.status} request'}, 400
+        
+        information_types = verification_request.information_types or []
+        uploads = {}
+        for slot in PHOTO_UPLOAD_SLOTS:
+            if slot not in information_types:
+                continue
+            post, key = s3_service.presign_upload(request_id, PHOTO_UPLOAD_EXPIRY)
+            if not post:
+                return {'error': 'Failed to prepare photo upload'}, 500
+            uploads[slot] = {'url': post['url'], 'fields': post['fields'], 'key': key}
+        
+        return {
+            'uploads': uploads,
+            'expires_in': PHOTO_UPLOAD_EXPIRY
+        }, 200
+        
+    except Exception as e:
+        current_app.logger.error(f"❌ Failed to presign verification photos: {str(e)}")
+        return {'error': 'Failed to prepare photo upload'}, 500
+
 @verification_bp.route('/verifications', methods=['POST'])
+@limiter.limit("30 per hour", override_defaults=False, error_message='30 verifications per hour allowed')
 @token_required
 def submit_verification(current_user_id):
     """Submit verification - Rate limited"""
-    # Apply rate limiting
-    if hasattr(current_app, 'limiter'):
-        limiter = current_app.limiter
-        limited = limiter.limit("30 per hour")(lambda: None)
-        try:
-            limited()
-        except:
-            return {'error': 'Rate limit exceeded', 'message': '30 verifications per hour allowed'}, 429
-    
     try:
         data = request.get_json()
         current_app.logger.info(f"🚀 Submitting verification response: {data}")
@@ -386,12 +569,12 @@ def submit_verification(current_user_id):
             return {'error': 'Request ID is required'}, 400
         
         request_id = data['request_id']
-        verification_request = Request.query.get(request_id)
+        verification_request = db.session.get(Request, request_id, options=[joinedload(Request.requester)])
         
         if not verification_request:
             return {'error': 'Request not found'}, 404
         
-        current_user = User.query.get(current_user_id)
+        current_user = g.current_user
         if not current_user or current_user.email != verification_request.target_email:
             return {'error': 'You can only respond to requests sent to you'}, 403
         
@@ -404,10 +587,11 @@ def submit_verification(current_user_id):
             views_allowed = 2
         
         new_key = ShareableKey(
-            key_uuid=str(uuid.uuid4()),
+            key_uuid=new_ulid(),
             creator_id=current_user_id,
             recipient_email=verification_request.requester.email,
             recipient_user_id=verification_request.requester_id,
+            source_request_id=verification_request.id,
             label=f"Response to: {verification_request.label}",
             views_allowed=views_allowed,  # Use the value from the request
             is_shareable_link=False,
@@ -415,95 +599,38 @@ def submit_verification(current_user_id):
             status='active'
         )
         
-        new_key.set_information_types(verification_request.get_information_types())
+        information_types = verification_request.information_types or []
+        new_key.information_types = information_types
         
         user_data = {}
-        information_types = verification_request.get_information_types()
         
-        # Parse additional_data if it exists
-        additional_data = {}
-        if 'additional_data' in data and data['additional_data']:
+        # additional_data arrives either as an object or as a JSON-encoded string
+        additional_data = data.get('additional_data') or {}
+        if isinstance(additional_data, str):
             try:
-                additional_data = json.loads(data['additional_data'])
-            except json.JSONDecodeError:
-                current_app.logger.warning(f"Failed to parse additional_data: {data['additional_data']}")
+                additional_data = orjson.loads(additional_data)
+            except orjson.JSONDecodeError:
+                current_app.logger.warning(f"Failed to parse additional_data: {additional_data}")
+                additional_data = {}
         
+        now = datetime.utcnow()
+        captured_at = now.isoformat()
         for info_type in information_types:
-            if info_type == 'fullname':
-                # Check additional_data first, then fall back to user profile
-                if 'fullname' in additional_data:
-                    user_data['fullname'] = additional_data['fullname']
-                elif current_user.first_name and current_user.last_name:
-                    user_data['fullname'] = f"{current_user.first_name} {current_user.last_name}"
-                else:
-                    user_data['fullname'] = "Name not available"
-            
-            elif info_type == 'firstname':
-                # Check additional_data first, then fall back to user profile
-                if 'firstname' in additional_data:
-                    user_data['firstname'] = additional_data['firstname']
-                else:
-                    user_data['firstname'] = current_user.first_name or "First name not available"
-            
-            elif info_type == 'age':
-                # Check additional_data first, then fall back to user profile
-                if 'age' in additional_data:
-                    user_data['age'] = str(additional_data['age'])
-                else:
-                    user_data['age'] = str(current_user.age) if current_user.age else "Age not provided"
-            
-            elif info_type == 'location':
-                if 'latitude' in data and 'longitude' in data:
-                    user_data['location'] = {
-                        'latitude': data['latitude'],
-                        'longitude': data['longitude'],
-                        'cityDisplay': data.get('location_city_display', 'Location captured')
-                    }
-                elif 'location_data' in data:
-                    user_data['location'] = data['location_data']
-                else:
-                    user_data['location'] = {
-                        'cityDisplay': 'Location not captured',
-                        'latitude': None,
-                        'longitude': None
-                    }
-            
-            # FIXED: Handle selfie and photo separately
-            elif info_type == 'selfie':
-                if 'selfie_base64' in data:
-                    user_data['selfie'] = {
-                        'status': 'captured',
-                        'image_data': data['selfie_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
-                    }
-                else:
-                    user_data['selfie'] = {
-                        'status': 'not_captured',
-                        'image_data': None,
-                        'captured_at': None
-                    }
-            
-            elif info_type == 'photo':
-                if 'photo_base64' in data:
-                    user_data['photo'] = {
-                        'status': 'captured',
-                        'image_data': data['photo_base64'],
-                        'captured_at': datetime.utcnow().isoformat()
-                    }
-                else:
-                    user_data['photo'] = {
-                        'status': 'not_captured',
-                        'image_data': None,
-                        'captured_at': None
-                    }
-        
-        new_key.set_user_data(user_data)
+            extract = RESPONSE_FIELDS.get(info_type)
+            if extract:
+                user_data[info_type] = extract(current_user, data, additional_data, request_id, captured_at)
+        
+        new_key.user_data = user_data
         
         db.session.add(new_key)
         
         verification_request.status = 'completed'
-        verification_request.response_at = datetime.utcnow()
+        verification_request.response_at = now
         
+        # One flush writes the key and the request; reading the ids before commit
+        # avoids the refresh SELECT that expire_on_commit would trigger
+        db.session.flush()
+        key_id, key_uuid = new_key.id, new_key.key_uuid
         db.session.commit()
         
         current_app.logger.info(f"✅ Verification response submitted: Request {request_id} by user {current_user_id}")
@@ -511,8 +638,8 @@ def submit_verification(current_user_id):
         
         return {
             'message': 'Verification response submitted successfully',
-            'key_id': new_key.id,
-            'key_uuid': new_key.key_uuid
+            'key_id': key_id,
+            'key_uuid': key_uuid
         }, 201
         
     except Exception as e:
@@ -10,21 +10,12 @@ class VerificationDataExtractor:
         information_types: List[str],
         submission_data: Dict[str, Any]
     ) -> Dict[str, Any]:
-        extractors = {
-            'fullname': lambda: VerificationDataExtractor._extract_fullname(user),
-            'firstname': lambda: VerificationDataExtractor._extract_firstname(user),
-            'age': lambda: VerificationDataExtractor._extract_age(user),
-            'location': lambda: VerificationDataExtractor._extract_location(submission_data),
-            'selfie': lambda: VerificationDataExtractor._extract_image(submission_data, 'selfie'),
-            'photo': lambda: VerificationDataExtractor._extract_image(submission_data, 'photo')
+        captured_at = datetime.utcnow().isoformat()
+        return {
+            info_type: extract(user, submission_data, captured_at)
+            for info_type in information_types
+            if (extract := _EXTRACTORS.get(info_type))
         }
-        
-        result = {}
-        for info_type in information_types:
-            if info_type in extractors:
-                result[info_type] = extractors[info_type]()
-        
-        return result
     
     @staticmethod
     def _extract_fullname(user: User) -> str:
@@ -76,13 +67,13 @@ class VerificationDataExtractor:
         }
     
     @staticmethod
-    def _extract_image(submission_data: Dict[str, Any], image_type: str) -> Dict[str, Any]:
+    def _extract_image(submission_data: Dict[str, Any], image_type: str, captured_at: str) -> Dict[str, Any]:
         image_key = f'{image_type}_data'
         if image_key in submission_data and submission_data[image_key]:
             return {
                 'status': 'captured',
                 'image_data': submission_data[image_key],
-                'captured_at': datetime.utcnow().isoformat()
+                'captured_at': captured_at
             }
         
         user_data = submission_data.get('user_data', {})
@@ -94,7 +85,7 @@ class VerificationDataExtractor:
                 return {
                     'status': 'captured',
                     'image_data': image_data,
-                    'captured_at': datetime.utcnow().isoformat()
+                    'captured_at': captured_at
                 }
         
         return {
@@ -103,6 +94,17 @@ class VerificationDataExtractor:
         }
 
 
+# Built once at import; every extractor takes (user, submission_data, captured_at)
+_EXTRACTORS = {
+    'fullname': lambda user, data, captured_at: VerificationDataExtractor._extract_fullname(user),
+    'firstname': lambda user, data, captured_at: VerificationDataExtractor._extract_firstname(user),
+    'age': lambda user, data, captured_at: VerificationDataExtractor._extract_age(user),
+    'location': lambda user, data, captured_at: VerificationDataExtractor._extract_location(data),
+    'selfie': lambda user, data, captured_at: VerificationDataExtractor._extract_image(data, 'selfie', captured_at),
+    'photo': lambda user, data, captured_at: VerificationDataExtractor._extract_image(data, 'photo', captured_at),
+}
+
+
 class KeyStatusManager:
     
     @staticmethod
@@ -132,16 +134,23 @@ class KeyStatusManager:
         old = []
         
         for key in keys:
-            KeyStatusManager.update_status_if_needed(key)
+            # Same transitions as update_status_if_needed, reading each column once
+            status = key.status
+            if status != 'revoked':
+                views_used, views_allowed = key.views_used, key.views_allowed
+                if views_used >= views_allowed:
+                    status = key.status = 'viewed_out'
+                elif status == 'viewed_out':
+                    status = key.status = 'active'
             
-            if key.status == 'active':
-                active.append(key)
-            else:
-                old.append(key)
+            (active if status == 'active' else old).append(key)
         
         return {'active': active, 'old': old}
 
 
+VALID_INFO_TYPES = frozenset({'fullname', 'firstname', 'age', 'location', 'selfie', 'photo'})
+EXCLUSIVE_NAME_TYPES = frozenset({'fullname', 'firstname'})
+
 class RequestValidator:
     
     @staticmethod
@@ -156,16 +165,16 @@ class RequestValidator:
         if not data.get('information_types'):
             return False, 'Information types are required'
         
-        valid_types = {'fullname', 'firstname', 'age', 'location', 'selfie', 'photo'}
         info_types = data.get('information_types', [])
         
         if not isinstance(info_types, list):
             return False, 'Information types must be a list'
         
-        if not all(t in valid_types for t in info_types):
+        info_set = set(info_types)
+        if not info_set <= VALID_INFO_TYPES:
             return False, 'Invalid information type'
         
-        if 'fullname' in info_types and 'firstname' in info_types:
+        if EXCLUSIVE_NAME_TYPES <= info_set:
             return False, 'Cannot request both fullname and firstname'
         
         return True, ''